@@ -0,0 +1,189 @@
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+
+
+Export pmp tables to arrow IPC and parquet files.  Needs numpy and
+pyarrow 0.16 (the last release for Python 2) or later.
+
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pass
+
+# arrow binary columns have 32 bit offsets
+_MAX_STRINGS = 0x7fffffff
+
+
+class ArrowExportError(Exception):
+    pass
+
+
+
+def _need(what):
+    '''Raise ArrowExportError unless pyarrow (and numpy) can be imported'''
+
+    if pyarrow is None or numpy is None:
+        raise ArrowExportError("%s needs pyarrow and numpy" % what)
+
+
+
+def stringBuffers(column):
+    '''
+
+    Return the (offsets, data) numpy arrays of a pmp string column (a list
+    of strings or a packed _PmpStrings) in the layout of an arrow binary
+    array:  string n is data[offsets[n]:offsets[n + 1]].
+
+    A packed column is converted without creating a string for each
+    entry:  its buffer already holds the strings back to back, just with a
+    null after each one, so the nulls are dropped from the buffer and
+    string n's offset moves down by n.
+
+    '''
+
+    if hasattr(column, 'offsets'):  # a _PmpStrings
+        first = column.offsets[0]
+        offsets = numpy.frombuffer(column.offsets, numpy.uint32)
+        offsets = offsets.astype(numpy.int64) - first - \
+            numpy.arange(len(offsets), dtype=numpy.int64)
+        data = column.buf[first:column.offsets[-1]].replace('\x00', '')
+    else:
+        offsets = numpy.zeros(len(column) + 1, numpy.int64)
+        numpy.cumsum(numpy.fromiter((len(s) for s in column), numpy.int64,
+                                    len(column)), out=offsets[1:])
+        data = "".join(column)
+
+    if len(data) > _MAX_STRINGS:
+        raise ArrowExportError("string column of %d bytes is too large"
+                               % len(data))
+
+    return offsets.astype(numpy.int32), numpy.frombuffer(data, numpy.uint8)
+
+
+
+def toArrow(pmp, columns=None):
+    '''
+
+    Return the columns (default all of them) of pmp (a PmpInfo) as a
+    pyarrow.Table.
+
+    The fixed width columns are handed to arrow as the numpy arrays of
+    PmpInfo.toNumpy(), which share memory with the columns, so their data
+    is not copied.  String columns are built from an offsets and a data
+    buffer (see stringBuffers()) instead of a Python string per entry.
+    They are binary columns, not strings:  the pmp files hold raw bytes in
+    whatever encoding Picasa wrote, which need not be valid UTF-8.
+
+    The table has as many rows as the longest column.  Shorter columns are
+    padded with nulls, which does copy them.
+
+    '''
+
+    _need("toArrow()")
+
+    if columns is None:
+        columns = pmp.columns
+
+    fixed = pmp.toNumpy([column for column in columns
+                         if pmp.type1[pmp.columns.index(column)] in
+                         (0x1, 0x2, 0x3, 0x4, 0x5, 0x7)])
+    rows = max([pmp.size[pmp.columns.index(column)]
+                for column in columns] or [0])
+
+    arrays = []
+    for column in columns:
+        if column in fixed:
+            values = pyarrow.array(fixed[column])
+        else:
+            offsets, data = stringBuffers(pmp.data[column])
+            values = pyarrow.Array.from_buffers(pyarrow.binary(),
+                len(offsets) - 1,
+                [None, pyarrow.py_buffer(offsets), pyarrow.py_buffer(data)])
+
+        if len(values) < rows:
+            values = pyarrow.concat_arrays([values,
+                pyarrow.array([None] * (rows - len(values)), values.type)])
+        arrays.append(values)
+
+    return pyarrow.Table.from_arrays(arrays, list(columns))
+
+
+
+def writeArrow(pmp, fileName, columns=None):
+    '''
+
+    Write the columns (default all of them) of pmp (a PmpInfo) to fileName
+    as an arrow IPC file (the format of feather version 2 files).
+
+    Usage:
+
+        from picasa3meta import arrowexport, pmpinfo
+
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata", lazy=True,
+                              packStrings=True)
+        arrowexport.writeArrow(pmp, "/path/to/imagedata.arrow")
+
+        # or, if pyarrow was built with parquet support
+        arrowexport.writeParquet(pmp, "/path/to/imagedata.parquet")
+
+    On a lazy table opened with packStrings=True the data goes from the
+    memory mapped pmp files to the output file without being converted to
+    Python objects.
+
+    '''
+
+    table = toArrow(pmp, columns)
+
+    sink = pyarrow.OSFile(fileName, "wb")
+    try:
+        writer = pyarrow.RecordBatchFileWriter(sink, table.schema)
+        try:
+            writer.write_table(table)
+        finally:
+            writer.close()
+    finally:
+        sink.close()
+
+
+
+def writeParquet(pmp, fileName, columns=None):
+    '''
+
+    Write the columns (default all of them) of pmp (a PmpInfo) to fileName
+    as a parquet file.  Raises ArrowExportError if pyarrow has no parquet
+    support.
+
+    '''
+
+    _need("writeParquet()")
+    if not hasattr(pyarrow, 'parquet'):
+        raise ArrowExportError("writeParquet() needs pyarrow.parquet")
+
+    pyarrow.parquet.write_table(toArrow(pmp, columns), fileName)
@@ -0,0 +1,197 @@
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+'''
+
+import collections
+import os
+
+from picasa3meta import iniinfo
+
+# everything known about one image:
+#   index: its entry in thumbindex.db (and row in the pmp tables)
+#   path:  its full path name
+#   pmp:   { column:value, ... } of its row in the pmp table
+#   ini:   [ (key, value), ... ] of its .picasa.ini entry (see IniInfo)
+#   exif:  the EXIV2Meta() list of its metadata, or None
+Record = collections.namedtuple('Record', 'index path pmp ini exif')
+
+
+class Catalog(object):
+    '''
+
+    Join what thumbindex.db, the pmp tables, the .picasa.ini files and
+    (optionally) the image files themselves know about each image.
+
+    Usage:
+
+        from picasa3meta import catalog, contacts, pmpinfo, thumbindex
+
+        db = thumbindex.ThumbIndex("/path/to/Picasa3/db3/thumbindex.db")
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata")
+        myContacts = contacts.Contacts("/path/to/contacts.xml")
+
+        cat = catalog.Catalog(db, pmp, myContacts,
+                              columns=["caption", "lat", "long"])
+
+        for record in cat.records(db.entriesUnder("/photos/2011/")):
+            print record.path, record.pmp["caption"]
+            for key, value in record.ini:
+                print "    %s = %s"%(key, value)
+
+        # and the EXIF/IPTC/XMP of each image, read by 8 threads
+        for record in cat.records(exif=True, workers=8, fast=True):
+            print record.path, record.exif
+
+    The entries are handled a directory at a time, so each .picasa.ini is
+    read once for all the images in its directory.  Without exif=True the
+    records come in directory order, with it in the order the image files
+    are read.
+
+    '''
+
+    def __init__(self, db, pmp=None, contacts=None, columns=None,
+                 iniName=".picasa.ini"):
+        '''
+
+        db is a thumbindex.ThumbIndex, pmp a pmpinfo.PmpInfo of the
+        imagedata table (or None) and contacts a contacts.Contacts which
+        is passed on to IniInfo (or None).  columns is the list of pmp
+        columns to put in each record, default all of them.
+
+        '''
+
+        self.db = db
+        self.pmp = pmp
+        self.contacts = contacts
+        self.iniName = iniName
+        if pmp is None:
+            self.columns = []
+        elif columns is None:
+            self.columns = list(pmp.columns)
+        else:
+            self.columns = list(columns)
+
+
+
+    def directories(self, entries=None):
+        '''
+
+        Yield (path, [ entry, ... ]) for each directory of the file
+        entries in 'entries' (default all of them).  Directories, deleted
+        entries and faces are left out.
+
+        '''
+
+        db = self.db
+        if entries is None:
+            if db.dirKeys is None:
+                db.buildDirIndex()
+            for n, path in enumerate(db.dirKeys):
+                files = db.dirFiles.get(db.dirEntries[n])
+                if files:
+                    yield path, files
+            return
+
+        groups = collections.OrderedDict()
+        for i in entries:
+            parent = db.pathIndex[i]
+            if parent != 0xffffffff:
+                groups.setdefault(parent, []).append(i)
+
+        for parent, files in groups.iteritems():
+            yield db.imagePath(files[0]), files
+
+
+
+    def readIni(self, path):
+        '''
+
+        Return the IniInfo of the .picasa.ini in directory path, or None if
+        there is none or it cannot be read.
+
+        '''
+
+        try:
+            return iniinfo.IniInfo(os.path.join(path, self.iniName),
+                                   self.contacts)
+        except (iniinfo.IniError, IOError):
+            return None
+
+
+
+    def records(self, entries=None, exif=False, workers=None, **options):
+        '''
+
+        Yield a Record for each image file in 'entries' (thumbindex.db
+        entry numbers, default all the images).
+
+        With exif=True the metadata of each image file is read as well, by
+        exiv2meta.batch() with 'workers' threads.  Any other keyword
+        arguments (keys, human, fast, processes, ...) are passed on to it.
+
+        '''
+
+        if not exif:
+            for record in self.joined(entries):
+                yield record
+            return
+
+        # only needed (and pyexiv2 only required) when reading the images
+        from picasa3meta import exiv2meta
+
+        waiting = {}
+
+        def paths():
+            for record in self.joined(entries):
+                waiting.setdefault(record.path, []).append(record)
+                yield record.path
+
+        for path, metaData in exiv2meta.batch(paths(), workers, **options):
+            yield waiting[path].pop(0)._replace(exif=metaData)
+            if not waiting[path]:
+                del waiting[path]
+
+
+
+    def joined(self, entries=None):
+        '''Yield the Records of records() without the exif part'''
+
+        db = self.db
+
+        columns = []
+        if self.pmp is not None:
+            for column in self.columns:
+                size = self.pmp.size[self.pmp.columns.index(column)]
+                columns.append((column, self.pmp.data[column], size))
+
+        for path, files in self.directories(entries):
+            ini = self.readIni(path)
+
+            for i in files:
+                name = db.name[i]
+
+                values = {}
+                for column, data, size in columns:
+                    values[column] = data[i] if i < size else ""
+
+                if ini is not None:
+                    pairs = ini.getFilePairs(name)
+                else:
+                    pairs = []
+
+                yield Record(i, os.path.join(path, name), values, pairs, None)
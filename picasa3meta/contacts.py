@@ -17,8 +17,56 @@ along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
 Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
 '''
 
+import collections
+import itertools
+import operator
+import xml.parsers.expat
 import xml.sax
 
+# the digits of the contact ids that are kept as numbers (see _key())
+_HEXDIGITS = "0123456789abcdef"
+
+# everything contacts.xml has about a contact, see Contacts.getDetails()
+Contact = collections.namedtuple('Contact',
+    'id name display modified_time local_contact')
+
+
+def _key(cid):
+    '''
+
+    Return the key of a contact id: the 16 (lower case) hex digit id as a
+    64 bit number, or the id string itself if it is not written that way.
+
+    '''
+
+    if not isinstance(cid, basestring) or len(cid) != 16 or \
+            cid.strip(_HEXDIGITS):
+        return cid
+    return int(cid, 16)
+
+def _keys(ids):
+    '''Return the list of the keys of a list of contact ids'''
+
+    # normally all of them are 16 hex digits and can be converted and
+    # checked at once
+    try:
+        keys = map(int, ids, itertools.repeat(16, len(ids)))
+    except (ValueError, TypeError):
+        return map(_key, ids)
+    joined = "".join(ids)
+    if len(joined) != 16 * len(ids) or \
+            ("%016x" * len(keys)) % tuple(keys) != joined:
+        return map(_key, ids)
+    return keys
+
+def _hex(key):
+    '''Return the contact id string of a key made by _key()'''
+
+    if isinstance(key, basestring):
+        return key
+    return '%016x' % key
+
+
 
 class Contacts(object):
     '''
@@ -32,11 +80,15 @@ class Contacts(object):
         from picasa3meta import contacts
 
         myContacts = contacts.Contacts("/path/to/contacts.xml")
-        print "%d contacts found"%len(myContacts.handler.mapping)
+        print "%d contacts found"%len(myContacts)
 
-        for contact_id in con.handler.mapping:
+        for contact_id in myContacts.ids():
             print "[%s] is [%s]"%(contact_id,myContacts.getContact(contact_id))
 
+        # everything about a contact, and the contacts with a name
+        print myContacts.getDetails("e1363a4accda66d5").modified_time
+        print myContacts.idsOf("First Last")
+
     The Picasa3 contacts.xml file has the form:
 
         <contacts>
@@ -49,25 +101,128 @@ class Contacts(object):
              .
         </contacts>
 
+    The file is read with expat directly, keeping the name, display,
+    modified_time and local_contact of each contact.  The ids are kept as
+    numbers, the 16 hex digits of the id as a 64 bit value, instead of
+    strings.  The old xml.sax reader can still be used with sax=True, then
+    only the names are kept.  Either way handler.mapping is the
+    { id:name } dict of the contacts.
+
     '''
 
 
-    def __init__(self, cFile):
-        '''Initialize the contacts parser.'''
+    def __init__(self, cFile, sax=False):
+        '''
+
+        Read the contacts file cFile (a file name or an open file).  Class
+        variables are:
+
+        contacts:
+            dictionary of the contacts { key:(name, display, modified_time,
+            local_contact), ... }, where key is the number of the contact
+            id (see _key())
+        names:
+            dictionary of the keys of the contacts with each name
+            { name:[ key, ... ], ... }, built the first time idsOf() is
+            called
+
+        '''
+
+        self.names = None
+        self._handler = None
+
+        if sax:
+            self.parser = xml.sax.make_parser()
+            self._handler = _ContactHandler()
+            self.parser.setContentHandler(self._handler)
+            self.parser.parse(cFile)
+            mapping = self._handler.mapping
+            self.contacts = dict(itertools.izip(_keys(mapping.keys()),
+                [(name, None, None, None) for name in mapping.itervalues()]))
+            return
+
+        # keep the attributes of each <contact>, they are taken apart a
+        # whole column at a time once the file has been read
+        found = []
+        append = found.append
+
+        def startElement(name, attributes):
+            if name == "contact":
+                append(attributes)
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = startElement
+        if hasattr(cFile, 'read'):
+            parser.ParseFile(cFile)
+        else:
+            inFile = open(cFile, "rb")
+            try:
+                parser.ParseFile(inFile)
+            finally:
+                inFile.close()
+
+        def column(attribute):
+            return map(dict.get, found,
+                       itertools.repeat(attribute, len(found)))
+
+        self.contacts = dict(itertools.izip(_keys(column("id")),
+            itertools.izip(column("name"), column("display"),
+                           column("modified_time"), column("local_contact"))))
+
+
+    @property
+    def handler(self):
+        '''An object with the { id:name } dict of the contacts as mapping'''
+
+        if self._handler is None:
+            self._handler = _ContactHandler()
+            self._handler.mapping = dict(itertools.izip(
+                itertools.imap(_hex, self.contacts.iterkeys()),
+                itertools.imap(operator.itemgetter(0),
+                               self.contacts.itervalues())))
+        return self._handler
+
+
+    def __len__(self):
+        return len(self.contacts)
+
+
+    def ids(self):
+        '''Return a list of the contact ids (the hex strings)'''
 
-        self.parser = xml.sax.make_parser()
-        self.handler = _ContactHandler()
-        self.parser.setContentHandler(self.handler)
-        self.parser.parse(cFile)
+        return map(_hex, self.contacts)
 
 
     def getContact(self, cid):
         '''Return the full name associated with the hex contact id'''
 
-        if self.handler.mapping.has_key(cid):
-            return self.handler.mapping[cid]
-        else:
+        contact = self.contacts.get(_key(cid))
+        if contact is None:
             return "unknown"
+        return contact[0]
+
+
+    def getDetails(self, cid):
+        '''Return the Contact of the hex contact id, or None'''
+
+        contact = self.contacts.get(_key(cid))
+        if contact is None:
+            return None
+        return Contact(_hex(_key(cid)), *contact)
+
+
+    def idsOf(self, name):
+        '''Return a list of the hex contact ids of the contacts called name'''
+
+        if self.names is None:
+            self.names = {}
+            for key, contact in self.contacts.iteritems():
+                try:
+                    self.names[contact[0]].append(key)
+                except KeyError:
+                    self.names[contact[0]] = [key]
+
+        return map(_hex, self.names.get(name, []))
 
 
 
@@ -0,0 +1,185 @@
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+'''
+
+import hashlib
+import marshal
+import os
+import tempfile
+
+# bump this whenever the layout of a cached payload changes
+_VERSION = 2
+
+
+class DbCache(object):
+    '''
+
+    Keep decoded copies of Picasa3 database files in a cache directory so
+    the next process that opens them does not have to parse them again.
+
+    Every source file (a <table>_<column>.pmp file or thumbindex.db) gets
+    its own cache file, stamped with the path, size, mtime and inode of the
+    source.  If any of those change that one cache file is ignored and
+    rewritten, the rest of the cache is still used.
+
+    Usage:
+
+        from picasa3meta import dbcache, pmpinfo, thumbindex
+
+        cache = dbcache.DbCache("/path/to/cache/dir")
+
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata",
+                              cache=cache)
+        db = thumbindex.ThumbIndex("/path/to/Picasa3/db3/thumbindex.db",
+                                   cache=cache)
+
+        print "cache hits: %(hits)d misses: %(misses)d" % cache.stats()
+
+    The cache directory can be anywhere, i.e. on a local disk when the
+    Picasa3 database is on a network share.  It is created if it does not
+    exist.
+
+    '''
+
+    def __init__(self, cacheDir):
+        '''
+
+        Use (and create if needed) the cache directory cacheDir.  Class
+        variables are:
+
+        hits:
+            number of source files loaded from the cache
+        misses:
+            number of source files that had no cache file
+        stale:
+            number of source files whose cache file was out of date (these
+            are also counted as misses)
+        errors:
+            number of cache files that could not be written
+
+        '''
+
+        self.cacheDir = cacheDir
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.errors = 0
+
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+
+
+    def key(self, srcFile, stamp=None):
+        '''
+
+        Return the (path, size, mtime, inode) stamp of a source file.  If
+        stamp is given it is the (size, mtime) to use instead of the
+        current ones.
+
+        '''
+
+        st = os.stat(srcFile)
+        if stamp is None:
+            stamp = (st.st_size, st.st_mtime)
+        return (os.path.abspath(srcFile), stamp[0], stamp[1], st.st_ino)
+
+
+
+    def cacheFile(self, srcFile):
+        '''Return the name of the cache file for a source file'''
+
+        return os.path.join(self.cacheDir,
+            hashlib.md5(os.path.abspath(srcFile)).hexdigest() + ".cache")
+
+
+
+    def load(self, srcFile):
+        '''
+
+        Return the payload saved for srcFile, or None if there is no cache
+        file or it is out of date.
+
+        '''
+
+        try:
+            inCache = open(self.cacheFile(srcFile), "rb")
+        except IOError:
+            self.misses += 1
+            return None
+
+        try:
+            try:
+                version, key, payload = marshal.load(inCache)
+            except (EOFError, ValueError, TypeError):
+                version, key, payload = None, None, None
+        finally:
+            inCache.close()
+
+        if version != _VERSION or key != self.key(srcFile):
+            self.stale += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return payload
+
+
+
+    def save(self, srcFile, payload, stamp=None):
+        '''
+
+        Save the payload for srcFile.  The payload can be anything marshal
+        can write (strings, numbers, tuples, lists, dicts).
+
+        stamp is the (size, mtime) of srcFile when the payload was read
+        from it.  Pass it whenever the file may have changed since, so the
+        payload is not saved as belonging to the newer file.
+
+        The cache file is written under a temporary name and then renamed
+        so other processes never see a partial file.  A cache file that
+        cannot be written is counted in self.errors and otherwise ignored.
+
+        '''
+
+        key = self.key(srcFile, stamp)
+        try:
+            fd, tmpName = tempfile.mkstemp(dir=self.cacheDir)
+        except (IOError, OSError):
+            self.errors += 1
+            return
+
+        try:
+            outCache = os.fdopen(fd, "wb")
+            try:
+                marshal.dump((_VERSION, key, payload), outCache)
+            finally:
+                outCache.close()
+            os.rename(tmpName, self.cacheFile(srcFile))
+        except (IOError, OSError):
+            self.errors += 1
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+
+
+
+    def stats(self):
+        '''Return the hit/miss counters as a dict'''
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'stale': self.stale, 'errors': self.errors}
@@ -16,10 +16,211 @@ along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
 
 Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
 '''
+import multiprocessing
+import multiprocessing.pool
+import struct
+
 import pyexiv2
 
+# give up on the fast path if a JPEG has more headers than this
+_MAX_HEADER = 1 << 20
+
+
+def _exifValue(tag, human=True):
+    '''The human_value of an Exif tag if possible, otherwise the raw_value'''
+
+    if human:
+        try:
+            return tag.human_value
+        except:
+            pass
+    return tag.raw_value
+
+def _iptcValue(tag, human=True):
+    '''The (first) raw_value of an Iptc tag, if that fails just value'''
+
+    try:
+        return tag.raw_value[0]
+    except:
+        return tag.value[0]
+
+def _xmpValue(tag, human=True):
+    '''
+
+    The raw_value of an Xmp tag, if that fails just value.  If the
+    raw_value is a dict, return a comma separated list of the values.
+
+    '''
+
+    if type(tag.raw_value) == dict:
+        nret = ""
+        for KK in tag.raw_value:
+            if len(nret) > 1:
+                nret = nret + ","
+            nret = nret + tag.raw_value[KK]
+        return nret
+
+    try:
+        return tag.raw_value
+    except:
+        return tag.value
+
+# how to convert the value of a tag, by the first part of its key
+_VALUE = {'Exif': _exifValue, 'Iptc': _iptcValue, 'Xmp': _xmpValue}
+
+
+
+def _wanted(allKeys, keys):
+    '''
+
+    Return the keys of allKeys that are in keys.  An entry of keys that
+    ends with '.' is a prefix ("Exif.GPSInfo.") and matches every key that
+    starts with it, any other entry has to match exactly.
+
+    '''
+
+    if keys is None:
+        return allKeys
+
+    exact = set([K for K in keys if not K.endswith('.')])
+    prefixes = tuple([K for K in keys if K.endswith('.')])
+    return [K for K in allKeys if K in exact or K.startswith(prefixes)]
+
+
+
+class LazyMeta(object):
+    '''
+
+    The metadata of one image, with each value only converted the first
+    time it is asked for.  Iterating over it gives the same (key, value)
+    tuples as the list EXIV2Meta() returns, and it can also be used like a
+    read only dictionary:
+
+        metaData = exiv2meta.EXIV2Meta("/path/to/file.jpg", lazy=True)
+        if "Exif.Photo.DateTimeOriginal" in metaData:
+            print metaData["Exif.Photo.DateTimeOriginal"]
+
+    It keeps the pyexiv2.ImageMetadata it was made from, so it cannot be
+    returned by batch() with processes=True.
+
+    '''
+
+    def __init__(self, metadata, keys, human=True):
+        self.metadata = metadata
+        self.names = keys
+        self.human = human
+        self.values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            if key not in self.names:
+                raise
+        value = self.values[key] = _VALUE[key.split('.', 1)[0]](
+            self.metadata[key], self.human)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for K in self.names:
+            yield (K, self[K])
+
+    def keys(self):
+        return list(self.names)
+
+    def items(self):
+        return list(self)
+
+
+
+def jpegHeader(img, maxSize=_MAX_HEADER):
+    '''
+
+    Return the start of the JPEG file img, all the segments (APP1 Exif and
+    XMP, APP13 IPTC, ...) up to where the image data starts, followed by
+    an end of image marker.  Only those bytes are read from the file.
+
+    Returns None if img is not a JPEG, its headers cannot be followed or
+    they are larger than maxSize.
+
+    The JPEG file format is:
+
+        |SOI  |marker|length|segment ...   |marker|length|...|SOS  |data...
+        |ff d8|ff xx |xx xx |length - 2 ...|ff xx |xx xx |...|ff da|
 
-def EXIV2Meta(img):
+    '''
+
+    inFile = open(img, "rb")
+    try:
+        if inFile.read(2) != '\xff\xd8':
+            return None
+
+        header = ['\xff\xd8']
+        size = 2
+        while True:
+            marker = inFile.read(4)
+            if len(marker) < 4 or marker[0] != '\xff':
+                return None
+            if marker[1] in '\xda\xd9':  # start of scan or end of image
+                break
+
+            length = struct.unpack('>H', marker[2:])[0]
+            size += length + 2
+            if length < 2 or size > maxSize:
+                return None
+
+            segment = inFile.read(length - 2)
+            if len(segment) < length - 2:
+                return None
+            header.append(marker)
+            header.append(segment)
+    finally:
+        inFile.close()
+
+    header.append('\xff\xd9')
+    return "".join(header)
+
+
+
+def _read(img, fast=False):
+    '''
+
+    Return the pyexiv2.ImageMetadata of img after reading it.  With fast,
+    JPEG files are read from just their headers (see jpegHeader()), any
+    other file or a JPEG whose headers cannot be read that way is read by
+    pyexiv2 as usual.
+
+    '''
+
+    if fast:
+        header = jpegHeader(img)
+        if header is not None:
+            try:
+                metadata = pyexiv2.ImageMetadata.from_buffer(header)
+                metadata.read()
+                return metadata
+            except:
+                pass
+
+    metadata = pyexiv2.ImageMetadata(img)
+    metadata.read()
+    return metadata
+
+
+
+def EXIV2Meta(img, keys=None, human=True, lazy=False, fast=False):
     '''
 
     Return a list of tuples of all the EXIF, IPTC and XMP metadata in a file.
@@ -32,50 +233,150 @@ def EXIV2Meta(img):
         for key,value in metaData:
             print "%s : %s"%(key,value)
 
+        # just the date and the GPS tags, without the human_value formatting
+        metaData = exiv2meta.EXIV2Meta("/path/to/file.jpg",
+            keys=["Exif.Photo.DateTimeOriginal", "Exif.GPSInfo."],
+            human=False)
+
     Exif keys will return the human_value if possible, otherwise the raw_value.
+    With human=False the (much cheaper) raw_value is always returned.
 
     Iptc keys will return the raw_value first, if that fails, just value
 
     Xmp keys may be dict objects.  If it is a dict, return a comma separated
     list of the values.  Otherwise, try the raw_value first, then just value.
 
+    keys, if given, is a list of the keys to return.  An entry ending in
+    '.' is a prefix ("Exif.GPSInfo.") and returns every key starting with
+    it.  Only the values of the returned keys are converted.
+
+    With lazy=True a LazyMeta is returned instead of the list, which only
+    converts a value when it is asked for.
+
+    With fast=True only the headers of a JPEG file are read (see
+    jpegHeader()) instead of the whole file, which matters for large
+    files on a network share.  Other files are read in full.
+
     '''
 
     try:
-        metadata = pyexiv2.ImageMetadata(img)
-        metadata.read()
+        metadata = _read(img, fast)
     except:
         return zip(['error'], ['%s is not an image' % img])
+
+    found = _wanted(metadata.exif_keys + metadata.iptc_keys +
+                    metadata.xmp_keys, keys)
+
+    if lazy:
+        return LazyMeta(metadata, found, human)
+
+    # zip the keys and values into a list of tuples and return it
+    return zip(found, [_VALUE[K.split('.', 1)[0]](metadata[K], human)
+                       for K in found])
+
+
+
+def _batchOne(img, options):
+    '''batch() worker: read the metadata of one image'''
+
+    try:
+        return (img, EXIV2Meta(img, **options))
+    except Exception, e:
+        return (img, zip(['error'], ['%s: %s' % (img, e)]))
+
+
+
+def batch(images, workers=None, processes=False, pending=None, **options):
+    '''
+
+    Read the metadata of every image in the iterable 'images' with a pool
+    of 'workers' threads (default one per CPU, 1 reads them in this
+    thread), or processes if processes is True.  Yields (image, metaData)
+    tuples as each image is finished, so not in the order of 'images'.
+    metaData is what EXIV2Meta() returns, including the [('error', ...)]
+    list for a file that cannot be read; one bad file does not stop the
+    batch.
+
+    Any other keyword arguments (keys, human, fast, lazy) are passed on to
+    EXIV2Meta().  lazy=True only works with threads, a LazyMeta cannot be
+    passed back from another process (ValueError).
+
+    At most 'pending' images (default 4 per worker) are handed to the pool
+    at a time, so 'images' can be a generator over a whole library.
+
+    Usage:
+
+        from picasa3meta import exiv2meta
+
+        for img, metaData in exiv2meta.batch(listOfFiles, workers=8,
+                                              fast=True):
+            for key, value in metaData:
+                print "%s %s : %s"%(img, key, value)
+
+    '''
+
+    if processes and options.get('lazy'):
+        # a LazyMeta holds the open pyexiv2 image, which cannot be pickled
+        raise ValueError("batch() cannot return lazy metadata from processes")
+
+    if workers == 1:
+        for img in images:
+            yield _batchOne(img, options)
+        return
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if pending is None:
+        pending = 4 * workers
+
+    if processes:
+        pool = multiprocessing.Pool(workers)
     else:
-        ret = []
+        pool = multiprocessing.pool.ThreadPool(workers)
 
-        for K in metadata.exif_keys:
-            try:
-                ret.append(metadata[K].human_value)
-            except:
-                ret.append(metadata[K].raw_value)
+    # [ (img, AsyncResult), ... ] of the images handed to the pool
+    running = []
+    try:
+        for img in images:
+            running.append((img, pool.apply_async(_batchOne, (img, options))))
 
-        for K in metadata.iptc_keys:
-            try:
-                ret.append(metadata[K].raw_value[0])
-            except:
-                ret.append(metadata[K].value[0])
-
-        for K in metadata.xmp_keys:
-            if type(metadata[K].raw_value) == dict:
-                # if the xmp key is a dict, return it as a comma separated list
-                nret = ""
-                for KK in metadata[K].raw_value:
-                    if len(nret) > 1:
-                        nret = nret + ","
-                    nret = nret + metadata[K].raw_value[KK]
-                ret.append(nret)
-            else:
-                try:
-                    ret.append(metadata[K].raw_value)
-                except:
-                    ret.append(metadata[K].value)
-
-        # zip the keys and values into a list of tuples and return it
-        return zip(metadata.exif_keys + metadata.iptc_keys + metadata.xmp_keys,
-                    ret)
+            # wait while the pool is full, then pass on whatever is done
+            for result in _finished(running, len(running) >= pending):
+                yield result
+
+        while running:
+            for result in _finished(running, True):
+                yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+
+def _finished(running, wait):
+    '''
+
+    batch(): remove the finished images from running and return their
+    (img, metaData).  If wait is True and none are finished wait for one.
+    A result that cannot be passed back from the pool (i.e. one that
+    cannot be pickled) gives the [('error', ...)] metaData.
+
+    '''
+
+    done = [item for item in running if item[1].ready()]
+    while wait and not done:
+        running[0][1].wait(0.05)
+        done = [item for item in running if item[1].ready()]
+
+    ret = []
+    for item in done:
+        running.remove(item)
+        img, result = item
+        try:
+            ret.append(result.get())
+        except Exception, e:
+            ret.append((img, zip(['error'], ['%s: %s' % (img, e)])))
+    return ret
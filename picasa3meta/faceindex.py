@@ -0,0 +1,272 @@
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+'''
+
+import array
+import marshal
+import os
+
+# bump this whenever the layout of a saved index changes
+_VERSION = 2
+
+# the albumdata token of the album Picasa3 keeps for each person
+_FACE_ALBUM = "]facealbum:"
+
+
+class FaceIndexError(Exception):
+    pass
+
+
+def albumPeople(albums, column="token"):
+    '''
+
+    Return { personalbumid:contactId, ... } from albums (a PmpInfo for the
+    albumdata table).  Each person has an album whose token is
+    "]facealbum:<contact id>", the imagedata_personalbumid of a face is the
+    row of that album.  Other albums are left out.
+
+    '''
+
+    people = {}
+    for row, token in enumerate(albums.data[column]):
+        if token.startswith(_FACE_ALBUM):
+            people[row] = token[len(_FACE_ALBUM):]
+    return people
+
+
+
+class FaceIndex(object):
+    '''
+
+    An inverted index of the people in a Picasa3 library:  for each person
+    a sorted array('I') of the thumbindex.db entries of the images they
+    are in.
+
+    People are identified by their contact id (the 16 hex digit string
+    from contacts.xml), whichever source they come from:
+
+        - addThumbIndex() maps the imagedata_personalbumid of each face
+          entry in thumbindex.db to the contact id of that album in the
+          albumdata table (see albumPeople())
+        - addIni() uses the contact ids of the faces= entries in the
+          .picasa.ini files
+
+    Usage:
+
+        from picasa3meta import faceindex, iniinfo, pmpinfo, thumbindex
+
+        db = thumbindex.ThumbIndex("/path/to/Picasa3/db3/thumbindex.db")
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata",
+                              columns=["personalbumid"])
+        albums = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "albumdata",
+                                 columns=["token"])
+
+        faces = faceindex.FaceIndex()
+        faces.addThumbIndex(db, pmp, albums)
+        for iniFile, myIni in iniinfo.scan("/path/to/photos"):
+            faces.addIni(myIni, db)
+        faces.save("/path/to/faces.idx")
+
+        # and in the next process
+        faces = faceindex.FaceIndex("/path/to/faces.idx")
+        for index in faces.lookup("e1363a4accda66d5"):
+            print db.imageFullName(index)
+
+        # images with both people in them
+        both = faces.intersect("e1363a4accda66d5", "d80c848976f5bab6")
+
+    '''
+
+    def __init__(self, fileName=None):
+        '''
+
+        Start an empty index, or load one written by save() from fileName.
+        Class variables are:
+
+        index:
+            dictionary of the finished index { person:array('I'), ... }
+        pending:
+            dictionary of entries added since the last finish()
+            { person:[ entry, ... ], ... }
+
+        '''
+
+        self.index = {}
+        self.pending = {}
+
+        if fileName is not None:
+            self.load(fileName)
+
+
+
+    def add(self, person, entry):
+        '''Record that the image at thumbindex entry 'entry' shows person'''
+
+        try:
+            self.pending[person].append(entry)
+        except KeyError:
+            self.pending[person] = [entry]
+
+
+
+    def addThumbIndex(self, db, pmp, albums, column="personalbumid"):
+        '''
+
+        Add the faces that Picasa3 found in the images of db (a ThumbIndex).
+        Each face is an entry of its own in thumbindex.db, its album is
+        taken from that entry's row in 'column' of pmp (a PmpInfo for the
+        imagedata table).  facesArray also lists the deleted files under
+        their directory, so entries whose parent is a directory are left
+        out.
+
+        albums is a PmpInfo for the albumdata table, or the
+        { personalbumid:contactId } dictionary of albumPeople().  Faces
+        whose album is not a person's album are skipped.
+
+        '''
+
+        if not isinstance(albums, dict):
+            albums = albumPeople(albums)
+
+        for image, faces in db.facesArray.iteritems():
+            if db.orgPathIndex[image] == 0xffffffff:  # a directory
+                continue
+            for face in faces:
+                person = albums.get(pmp.getCol(column, face))
+                if person is not None:
+                    self.add(person, image)
+
+
+
+    def addIni(self, ini, db):
+        '''
+
+        Add the faces= entries of ini (an IniInfo) for the images that are
+        in db (a ThumbIndex).
+
+        '''
+
+        images = [image for image in ini.names if ini.getFaces(image)]
+        indexes = db.indexOfFiles(
+            [os.path.join(ini.filePath, image) for image in images])
+
+        for image, entry in zip(images, indexes):
+            if entry >= 0:
+                for rect, person in ini.getFaces(image):
+                    self.add(person, entry)
+
+
+
+    def finish(self):
+        '''Merge the pending entries into the sorted index arrays'''
+
+        for person, entries in self.pending.iteritems():
+            if person in self.index:
+                entries.extend(self.index[person])
+            self.index[person] = array.array('I', sorted(set(entries)))
+
+        self.pending = {}
+
+
+
+    def lookup(self, person):
+        '''
+
+        Return the sorted array('I') of the thumbindex entries of the images
+        showing person (empty if there are none).
+
+        '''
+
+        if self.pending:
+            self.finish()
+
+        return self.index.get(person, array.array('I'))
+
+
+
+    def intersect(self, *people):
+        '''
+
+        Return the sorted array('I') of the thumbindex entries of the images
+        showing all of people.
+
+        '''
+
+        found = sorted([self.lookup(person) for person in people], key=len)
+        if not found:
+            return array.array('I')
+
+        common = set(found[0])
+        for entries in found[1:]:
+            if not common:
+                break
+            common.intersection_update(entries)
+
+        return array.array('I', sorted(common))
+
+
+
+    def people(self):
+        '''Return a list of all the people in the index'''
+
+        if self.pending:
+            self.finish()
+
+        return self.index.keys()
+
+
+
+    def save(self, fileName):
+        '''Write the index to fileName'''
+
+        if self.pending:
+            self.finish()
+
+        index = {}
+        for person, entries in self.index.iteritems():
+            index[person] = entries.tostring()
+
+        outFile = open(fileName, "wb")
+        try:
+            marshal.dump((_VERSION, index), outFile)
+        finally:
+            outFile.close()
+
+
+
+    def load(self, fileName):
+        '''Replace the index with the one saved in fileName'''
+
+        inFile = open(fileName, "rb")
+        try:
+            try:
+                version, index = marshal.load(inFile)
+            except (EOFError, ValueError, TypeError):
+                raise FaceIndexError("%s is not a face index" % fileName)
+        finally:
+            inFile.close()
+
+        if version != _VERSION:
+            raise FaceIndexError("%s has version %s, expected %d" %
+                                 (fileName, version, _VERSION))
+
+        self.index = {}
+        self.pending = {}
+        for person, entries in index.iteritems():
+            self.index[person] = array.array('I')
+            self.index[person].fromstring(entries)
@@ -16,8 +16,18 @@ along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
 
 Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
 '''
+import multiprocessing
 import os
-import re
+
+from picasa3meta import rect64
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 class IniError(Exception):
@@ -55,6 +65,13 @@ class IniInfo(object):
                 print "        %s"%iniEntry
 
 
+        --OR-- without splitting "key:value" again
+
+        for imageFile in myIni.names:
+            for key, value in myIni.getFilePairs(imageFile):
+                print "        %s = %s"%(key, value)
+
+
 
     Picasa3 creates a .picasa.ini file in each directory with the format:
 
@@ -105,7 +122,14 @@ class IniInfo(object):
         A list of filename in this .picasa.ini is save in self.names[] for
         convenience.
 
-        The contents of this .picasa.ini are stored as self.contents{}
+        The contents of this .picasa.ini are stored as self.pairs{}, a list
+        of (key, value) tuples for each file name.  A line without an '='
+        is stored as (line, None).  self.contents{} has the same entries as
+        "key:value" strings.
+
+        The faces and crop entries are also decoded (see rect64) into
+        self.faces{}, a list of ((x1, y1, x2, y2), contact_id) tuples for
+        each file name, and self.crops{}, an (x1, y1, x2, y2) tuple.
 
         contacts, if specified, must be a picasa3meta.contacts.Contacts object.
 
@@ -114,73 +138,120 @@ class IniInfo(object):
         self.filePath = os.path.dirname(iniFile)
 
         self.names = []  # a list of files names in this .picasa.ini
-        self.contents = {}  # a dict, indexed by names[x],
-                            # containing a list of string objects
+        self.pairs = {}  # a dict, indexed by names[x],
+                         # containing a list of (key, value) tuples
+        self.faces = {}  # a dict of the decoded faces of each image
+        self.crops = {}  # a dict of the decoded crop of each image
+        self._contents = None
 
         inIni = open(iniFile, "r")
-        i = 0
+        try:
+            lines = inIni.read().split('\n')
+        finally:
+            inIni.close()
+
+        if lines[-1] == "":  # the file ended with a newline
+            lines.pop()
+
+        entry = None
+
+        for line in lines:
+            line = line.rstrip('\r')
+
+            # check if line is "^[<image>]$" (start of a file entry)
+            if line[:1] == '[':
+                image = line[1:].split(']', 1)[0]
+                if image:
+                    # Yes? Create a new entry in names/pairs
+                    self.names.append(image)
+                    entry = self.pairs[image] = []
+                    continue
+
+            # No? Append the line to the current pairs[names[x]] list
+            if entry is None:
+                raise IniStructError(
+                    "unexpected lines in %s before a file designator"\
+                    % iniFile)
+
+            (key, sep, val) = line.partition('=')
+            if not sep:
+                entry.append((line, None))
+                continue
+
+            entry.append((key, val))
+            if key == "faces":
+                self.faces[image] = rect64.decodeFaces(val)
+                if contacts != None:
+                    sfaces = []
+                    for people in val.split(';'):
+                        person = people.split(',')
+                        # people has the form 'rect(),id', so split that
+                        # on the ',' and the id is person[1]
+                        sfaces.append(
+                            '"' + contacts.getContact(person[1]) + '"')
+                    entry.append(("sfaces", ",".join(sfaces)))
+            elif key == "crop":
+                crop = rect64.decode(val)
+                if crop is not None:
+                    self.crops[image] = crop
+                    entry.append(("cropxy", "%f,%f,%f,%f" % crop))
+
+
+
+    @property
+    def contents(self):
+        '''
 
-        for line in inIni:
-            line = line.rstrip('\n\r')
-            try:
-                # check if line is "^[<image>]$" (start of a file entry)
-                m = re.search('(?<=\[)[^\]]+', line)
-                image = m.group(0)
-
-                # Yes? Create a new entry in names/contents
-                self.names.append(image)
-                self.contents[self.names[i]] = []
-                i += 1
-
-            except:
-                # No? Append the line to the current contents[names[x]] dict
-                if len(self.names) == 0:
-                    raise IniStructError(
-                        "unexpected lines in %s before a file designator"\
-                        % iniFile)
-                else:
-                    self.contents[self.names[i - 1]].\
-                        append(line.replace('=', ':', 1))
-                    (key, sep, val) = line.partition('=')
-                    if key == "faces" and contacts != None:
-                        sfaces = "sfaces:"
-                        for people in val.split(';'):
-                            if sfaces != "sfaces:":
-                                sfaces += ","
-                            person = people.split(',')
-                            # people has the form 'rect(),id', so split that
-                            # on the ',' and the id is person[1]
-                            sfaces += '"' + contacts.getContact(person[1]) + '"'
-                        self.contents[self.names[i - 1]].append(sfaces)
-                    elif key == "crop":
-                        m1 = re.search('(?<=rect64\()[^\)]+', val)
-                        crop64 = long(m1.group(0), 16)
-                        mx = float(int(0xffff))
-                        x1 = float((crop64 & 0xffff000000000000) >> 48) / mx
-                        y1 = float((crop64 & 0x0000ffff00000000) >> 32) / mx
-                        x2 = float((crop64 & 0x00000000ffff0000) >> 16) / mx
-                        y2 = float(crop64 & 0x000000000000ffff) / mx
-                        self.contents[self.names[i - 1]].append(
-                            "cropxy:%f,%f,%f,%f" % (x1, y1, x2, y2))
-        inIni.close()
+        The entries as { filename:[ "key:value", ... ], ... }, built from
+        self.pairs the first time it is used.
+
+        '''
+
+        if self._contents is None:
+            self._contents = {}
+            for image in self.names:
+                self._contents[image] = self.getFileEntry(image)
+        return self._contents
 
 
 
     def getFileEntry(self, image):
         '''Return a list of strings of the ini file entries for this image.'''
 
-        if self.contents.has_key(image):
-            return self.contents[image]
+        if image in self.pairs:
+            return [key if val is None else key + ":" + val
+                    for key, val in self.pairs[image]]
         else:
             return []
 
 
 
+    def getFaces(self, image):
+        '''Return the decoded faces as [ ((x1, y1, x2, y2), id), ... ]'''
+
+        return self.faces.get(image, [])
+
+
+
+    def getCrop(self, image):
+        '''Return the decoded crop (x1, y1, x2, y2) of this image or None'''
+
+        return self.crops.get(image)
+
+
+
+    def getFilePairs(self, image):
+        '''Return the (key, value) ini file entries for this image.'''
+
+        return self.pairs.get(image, [])
+
+
+
     def iniEntry(self, index):
         ''' Diagnostic function - returns an entry by index '''
 
         return  [ self.names[index], self.filePath,
-                 self.contents[self.names[index]] ]
+                 self.getFileEntry(self.names[index]) ]
 
 
 
@@ -189,6 +260,109 @@ class IniInfo(object):
 
         for i in range(len(self.names)):
             ret = [ os.path.join(self.filePath, self.names[i] + ".ini") ] + \
-                self.contents[self.names[i]]
+                self.getFileEntry(self.names[i])
             for j in range(len(ret)):
                 yield ret[j]
+
+
+
+def findIni(root, iniName=".picasa.ini"):
+    '''
+
+    Find all the iniName files in the directory tree under root.  Uses
+    scandir (os.scandir, or the scandir module on older Pythons) so no
+    extra stat() is needed per directory entry, falling back on
+    os.listdir() if neither is available.
+
+    '''
+
+    dirs = [os.path.abspath(root)]
+    while dirs:
+        path = dirs.pop()
+        if scandir is not None:
+            try:
+                entries = list(scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.name == iniName:
+                    yield entry.path
+        else:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                continue
+            for name in names:
+                full = os.path.join(path, name)
+                if os.path.isdir(full) and not os.path.islink(full):
+                    dirs.append(full)
+                elif name == iniName:
+                    yield full
+
+
+
+# the Contacts object of the scan() worker processes
+_scanContacts = None
+
+def _initScan(contacts):
+    '''scan() worker process initializer'''
+
+    global _scanContacts
+    _scanContacts = contacts
+
+def _scanOne(iniFile):
+    '''scan() worker: parse one .picasa.ini'''
+
+    try:
+        return (iniFile, IniInfo(iniFile, _scanContacts))
+    except (IniError, IOError), e:
+        return (iniFile, e)
+
+
+
+def scan(root, contacts=None, workers=None, iniName=".picasa.ini"):
+    '''
+
+    Parse every .picasa.ini file under root with a pool of 'workers'
+    processes (default one per CPU, 1 parses them in this process).
+    Yields (iniFile, IniInfo) tuples in the order the files are parsed.  A
+    file that cannot be parsed yields (iniFile, exception) instead so one
+    bad file does not stop the scan.
+
+    contacts, if given, is handed to each worker process once when it
+    starts rather than with every file.
+
+    Usage:
+
+        from picasa3meta import iniinfo
+
+        for iniFile, myIni in iniinfo.scan("/path/to/photos", myContacts):
+            if isinstance(myIni, Exception):
+                print "%s: %s"%(iniFile, myIni)
+            else:
+                print "%s has %d images"%(iniFile, len(myIni.names))
+
+    '''
+
+    if workers == 1:
+        _initScan(contacts)
+        try:
+            for iniFile in findIni(root, iniName):
+                yield _scanOne(iniFile)
+        finally:
+            _initScan(None)
+        return
+
+    pool = multiprocessing.Pool(workers, _initScan, (contacts,))
+    try:
+        for result in pool.imap_unordered(_scanOne, findIni(root, iniName),
+                                          16):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
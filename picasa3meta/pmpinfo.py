@@ -21,11 +21,42 @@ Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
 import os
 import fnmatch
 import array
+import collections
+import itertools
 import math
 import datetime
-import re
+import mmap
+import multiprocessing
+import multiprocessing.pool
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# every pmp file starts with a 20 byte header (see PmpInfo.doHeader())
+_HEADER_SIZE = 20
+
+# struct format for the fixed width column types
+_FIXED = {
+    0x1: '<I',  # unsigned integers (4 bytes)
+    0x2: '<d',  # double float (8 bytes)
+    0x3: '<B',  # unsigned char (1 byte)
+    0x4: '<Q',  # unsigned long (8 bytes)
+    0x5: '<H',  # unsigned short (2 bytes)
+    0x7: '<I',  # unsigned integers (4 bytes)
+}
+
+# time zero of the epoch seconds returned by PmpInfo.variantTimes()
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# numpy dtype of the fixed width column types
+_DTYPE = {0x1: '<u4', 0x2: '<f8', 0x3: 'u1', 0x4: '<u8', 0x5: '<u2', 0x7: '<u4'}
+
+# array typecode of the fixed width column types when they are read in full
+_ARRAY = {0x1: 'I', 0x2: 'd', 0x3: 'B', 0x4: 'L', 0x5: 'H', 0x7: 'I'}
+
 def locatedir(pattern, start):
     '''Search for a directory'''
     for path, dirs, files in os.walk(os.path.abspath(start)):
@@ -52,6 +83,288 @@ class PmpSizeError(PmpError):
 class    PmpTypeError(PmpError):
     pass
 
+def readHeader(pmp):
+    '''
+    read and verify the pmp file header:
+
+    magic------|type1|c1---|c2---------|type2|size----------|
+    3f cc cc cd|T1 T1|13 32|00 00 00 02|T2 T2|SS SS SS SS SS|
+
+    Returns the tuple (magic, type1, c1, c2, type2, c4, size)
+
+    '''
+
+    magic = struct.unpack("I", pmp.read(4))[0]
+    type1 = struct.unpack("H", pmp.read(2))[0]
+    c1 = struct.unpack("H", pmp.read(2))[0]
+    c2 = struct.unpack("I", pmp.read(4))[0]
+    type2 = struct.unpack("H", pmp.read(2))[0]
+    c4 = struct.unpack("H", pmp.read(2))[0]
+    size = struct.unpack("I", pmp.read(4))[0]
+
+    if magic != 0x3fcccccd:
+        raise PmpMagicError(
+            "failed magic: (0x3fcccccd) %#x" % magic)
+
+    if c1 != 0x1332:
+        raise PmpMagicError("failed c1: (0x1332) %#x" % c1)
+
+    if c2 != 0x00000002:
+        raise PmpMagicError("failed c1: (0x00000002) %#x" % c2)
+
+    if c4 != 0x1332:
+        raise PmpMagicError("failed c4: (0x1332) %#x" % c4)
+
+    if type1 != type2:
+        raise PmpTypeError(
+            "type1 (%#x) not equal to type2 (%#x)" % (type1, type2))
+
+    return (magic, type1, c1, c2, type2, c4, size)
+
+
+
+def tableFiles(dbpath, dbtable, columns=None, exclude=None):
+    '''
+    Find the pmp files of a table.  Returns a list of tuples:
+
+        [ (column, "/path/to/<table>_<column>.pmp"), ... ]
+
+    columns, if given, is a list of the columns to keep.  exclude is a glob
+    pattern (or a list of them) of columns to drop, i.e. "*@*" for the
+    per-account columns like 'wayne@mindtunnel.com_lhlist'.
+
+    '''
+
+    if isinstance(exclude, basestring):
+        exclude = [exclude]
+
+    ret = []
+    prefix = dbtable + "_"
+    for dbFile in locate(prefix + "*.pmp", dbpath):
+        # the column name is the file name without the .pmp and the
+        # leading '<table>_'
+        column = os.path.splitext(os.path.basename(dbFile))[0][len(prefix):]
+        if columns is not None and column not in columns:
+            continue
+        if exclude and \
+                [x for x in exclude if fnmatch.fnmatchcase(column, x)]:
+            continue
+        ret.append((column, dbFile))
+
+    if columns is not None:
+        missing = set(columns) - set([column for column, dbFile in ret])
+        if missing:
+            raise PmpError("no column(s) %s in table %s" %
+                           (", ".join(sorted(missing)), dbtable))
+
+    return ret
+
+
+
+def describe(dbpath, dbtable, columns=None, exclude=None):
+    '''
+    Read just the headers of a table.  Returns a list of tuples:
+
+        [ (column, type, size), ... ]
+
+    columns and exclude select the columns the same way as tableFiles().
+
+    '''
+
+    ret = []
+    for column, dbFile in tableFiles(dbpath, dbtable, columns, exclude):
+        pmp = open(dbFile, "rb")
+        try:
+            header = readHeader(pmp)
+        finally:
+            pmp.close()
+        ret.append((column, header[1], header[6]))
+
+    return ret
+
+
+
+class _PmpColumn(object):
+    '''
+    Read only view of a fixed width column in a memory mapped pmp file.
+
+    Nothing is copied out of the mapping until an entry is requested, so
+    opening a column costs the same no matter how many entries it has.
+
+    '''
+
+    def __init__(self, buf, fmt, count):
+        self.buf = buf
+        self.unpack = struct.Struct(fmt).unpack_from
+        self.width = struct.calcsize(fmt)
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("pmp column index out of range")
+        return self.unpack(self.buf, _HEADER_SIZE + index * self.width)[0]
+
+    def __iter__(self):
+        return self.iterRange(0, self.count)
+
+    def iterRange(self, start, stop):
+        '''Iterate over entries start to stop-1 (like col[start:stop])'''
+        start, stop, step = slice(start, stop).indices(self.count)
+        for i in xrange(start, stop):
+            yield self.unpack(self.buf, _HEADER_SIZE + i * self.width)[0]
+
+
+
+class _PmpStrings(object):
+    '''
+    Read only view of a null terminated string column kept as one buffer
+    plus an array of the offset where each string starts.
+
+    The buffer can be a string or a memory mapped file.  The individual
+    strings are only created when they are requested.
+
+    '''
+
+    def __init__(self, buf, start=0, offsets=None):
+        self.buf = buf
+        self.offsets = array.array('I')
+
+        if offsets is not None:  # already known (i.e. from a DbCache)
+            self.offsets.fromstring(offsets)
+            return
+
+        # offsets[n] is the start of string n, the last offset is one past
+        # the null of the last complete string
+        find = buf.find
+        self.offsets.append(start)
+        pos = find('\x00', start)
+        while pos >= 0:
+            pos += 1
+            self.offsets.append(pos)
+            pos = find('\x00', pos)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("pmp column index out of range")
+        return self.buf[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    def __iter__(self):
+        return self.iterRange(0, len(self))
+
+    def iterRange(self, start, stop):
+        '''Iterate over entries start to stop-1 (like col[start:stop])'''
+        start, stop, step = slice(start, stop).indices(len(self))
+        buf = self.buf
+        offsets = self.offsets
+        for i in xrange(start, stop):
+            yield buf[offsets[i]:offsets[i + 1] - 1]
+
+
+
+def _readColumn(job):
+    '''
+
+    Pool worker for PmpInfo.doColumns(): read the data of one pmp file.
+    job is (dbFile, type, size, packStrings), returns the column the same
+    way PmpInfo.doColumn() would store it in data[].
+
+    '''
+
+    dbFile, colType, size, packStrings = job
+
+    pmp = open(dbFile, "rb")
+    try:
+        pmp.seek(_HEADER_SIZE)
+        if colType in _ARRAY:
+            col = array.array(_ARRAY[colType])
+            try:
+                # request 2x what I expect to force an error if the file is
+                # short
+                col.fromfile(pmp, size * 2)
+            except EOFError:
+                pass
+        elif packStrings:
+            col = _PmpStrings(pmp.read())
+        else:
+            col = pmp.read().split(chr(0))[:-1]
+    finally:
+        pmp.close()
+
+    return col
+
+
+
+class _LazyData(dict):
+    '''
+
+    PmpInfo.data for lazy tables: columns are decoded on first access.
+    Every column of the table is a key, whether it is loaded yet or not;
+    get(), values() and items() load the columns they return.  The dict
+    methods themselves (dict.__contains__() and so on) only see the loaded
+    columns.
+
+    '''
+
+    def __init__(self, pmp):
+        dict.__init__(self)
+        self.pmp = pmp
+
+    def __missing__(self, column):
+        if column not in self.pmp.columns:
+            raise KeyError(column)
+        return self.pmp.loadColumn(self.pmp.columns.index(column))
+
+    def __contains__(self, column):
+        return column in self.pmp.columns
+
+    has_key = __contains__
+
+    def get(self, column, default=None):
+        if column not in self.pmp.columns:
+            return default
+        return self[column]
+
+    def __len__(self):
+        return len(self.pmp.columns)
+
+    def __iter__(self):
+        return iter(list(self.pmp.columns))
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self.pmp.columns)
+
+    def itervalues(self):
+        for column in self.keys():
+            yield self[column]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        for column in self.keys():
+            yield column, self[column]
+
+    def items(self):
+        return list(self.iteritems())
+
+
+
 class PmpInfo(object):
     '''
 
@@ -88,6 +401,19 @@ class PmpInfo(object):
 
         pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata")
 
+        # or just the columns you need
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata",
+                              columns=["caption", "lat", "long"])
+
+        # or everything except the per-account columns
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata",
+                              exclude="*@*")
+
+        # see what is in a table without reading any data
+        for col, type, size in pmpinfo.describe("/path/to/Picasa3/db3",
+                                                "imagedata"):
+            print "column %s type %#x has %d entries"%(col,type,size)
+
         print "columns in %stable:"%pmp.tableName
         for col in pmp.columns:
             print "    %x"%col
@@ -99,11 +425,47 @@ class PmpInfo(object):
         for col, value in pmp.getEntry(500):
             print "columns %s = %s"%(col,value)
 
+        # after Picasa has changed the database re-read what changed
+        changes = pmp.refresh()
+        print "reloaded columns: %s"%changes['columns']
+
+    Decoded columns can be kept in a dbcache.DbCache (cache=DbCache(...))
+    so the next PmpInfo for the same table loads them from there.
+
+    String columns can be kept packed (packStrings=True): one buffer per
+    column and an array of offsets instead of a list with a string object
+    for every entry.  The strings are created as they are requested.
+
+    Columns are separate files, so they can be read in parallel.  With
+    workers=N they are read by a pool of N threads:
+
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata", workers=4)
+
+    The fixed width columns can be had as numpy arrays for analysis (see
+    toNumpy() and asStructured()) if numpy is installed.
+
+    If you only need a few columns of a large table open it with lazy=True.
+    Only the headers are read up front and each column is loaded the first
+    time it is used through data[], getCol() or getEntry().  Fixed width
+    columns are then read straight out of a memory mapped file:
+
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata", lazy=True)
+        print pmp.getCol("caption", 500), pmp.getCol("lat", 500)
+
     '''
 
-    def __init__(self, dbpath, dbtable):
+    def __init__(self, dbpath, dbtable, lazy=False, packStrings=False,
+                 cache=None, workers=None, columns=None, exclude=None):
         '''
-        Read the entire table.  Class variables are:
+        Read the entire table, or with lazy=True just the column headers.
+        columns (a list of column names) and exclude (a glob pattern or a
+        list of them) select the columns to read (see tableFiles()).
+        With packStrings=True string columns are not split into a list of
+        strings (see _PmpStrings).  If cache is a dbcache.DbCache columns
+        are loaded from it when their pmp file has not changed.  Memory
+        mapped columns of a lazy table are never cached.  If workers is
+        given the columns of a full read are loaded by doColumns().  Class
+        variables are:
 
         tableName:
             i.e. 'imagedata'
@@ -113,6 +475,7 @@ class PmpInfo(object):
             dictionary of all data, i.e.
             { 'caption':[ 'cap 0', 'cap 1', ... ],
               'date': [ d0, d1, ... ], ... }
+            (for a lazy table the columns are loaded as they are used)
         magic:
             list of magic byte from each file.  shoule be
             [ 0x3fcccccd, 0x3fcccccd, ... ]
@@ -127,12 +490,28 @@ class PmpInfo(object):
             list of type of data in this column.  must equal type1
         size:
             list of length of each column: [ 2000, 3000, 1295, ... ]
+        files:
+            list of the pmp file for each column
+        stamps:
+            list of (size, mtime) of each pmp file when it was read
+        times:
+            dictionary of the columns converted by getTime()
+        maps:
+            dictionary of the memory mapped files of a lazy table
 
         '''
 
         self.tableName = dbtable
+        self.lazy = lazy
+        self.packStrings = packStrings
+        self.cache = cache
         self.columns = []
-        self.data = {}
+        self.files = []
+        self.maps = {}
+        if lazy:
+            self.data = _LazyData(self)
+        else:
+            self.data = {}
 
         self.magic = []
         self.type1 = []
@@ -141,114 +520,303 @@ class PmpInfo(object):
         self.type2 = []
         self.c4 = []
         self.size = []
+        self.stamps = []
+        self.times = {}
 
         i = 0
 
-        for dbFile in locate(self.tableName + "_*.pmp", dbpath):
-            count = 0
-            self.columns.append("")
-
-            # find the column name in this file (drop the .pmp and
-            # remove everything before (and including) the first '_'
-            m = re.search('(?<=_)[^$]+', os.path.splitext(dbFile)[0])
-            self.columns[i] = m.group(0)
+        for column, dbFile in tableFiles(dbpath, dbtable, columns, exclude):
+            self.columns.append(column)
+            self.files.append(dbFile)
 
             pmp = open(dbFile, "rb")
 
             self.doHeader(pmp, i)
 
-            if self.type1[i] == 0x0:  # null terminated strings
-                count = self.doStrings(pmp, self.columns[i])
-
-                # if self.columns[i] == 'facerectdata':
-                #    print 'count is %d'%count
-                #    for n in range(count):
-                #        print '%04d = %s'%(n,self.data[self.columns[i]][n])
-
-                # print self.data[self.columns[i]]
-            elif self.type1[i] == 0x1:  # unsigned integers (4 bytes)
-                count = self.doUint(pmp, self.columns[i], self.size[i])
-            elif self.type1[i] == 0x2:  # double float (8 bytes)
-                count = self.doFloat(pmp, self.columns[i], self.size[i])
-            elif self.type1[i] == 0x3:  # unsigned char (1 byte)
-                count = self.doByte(pmp, self.columns[i], self.size[i])
-            elif self.type1[i] == 0x4:  # unsigned long (8 bytes)
-                count = self.doUlong(pmp, self.columns[i], self.size[i])
-            elif self.type1[i] == 0x5:  # unsigned short (2 bytes)
-                count = self.doUshort(pmp, self.columns[i], self.size[i])
-            elif self.type1[i] == 0x6:  # null terminated strings
-                count = self.doStrings(pmp, self.columns[i])
-            elif self.type1[i] == 0x7:  # unsigned integers (4 bytes)
-                count = self.doUint(pmp, self.columns[i], self.size[i])
-            else:
+            if not lazy and not workers:
+                self.doColumn(pmp, i)
+
+            i += 1
+            pmp.close()
+
+        if not lazy and workers:
+            self.doColumns(workers)
+
+
+
+    def doColumn(self, pmp, i):
+        '''Read the data for column i, pmp must be positioned after the header'''
+
+        if self.cache is not None and self.fromCache(i):
+            return
+
+        count = 0
+
+        if self.type1[i] == 0x0:  # null terminated strings
+            count = self.doStrings(pmp, self.columns[i])
+
+            # if self.columns[i] == 'facerectdata':
+            #    print 'count is %d'%count
+            #    for n in range(count):
+            #        print '%04d = %s'%(n,self.data[self.columns[i]][n])
+
+            # print self.data[self.columns[i]]
+        elif self.type1[i] == 0x1:  # unsigned integers (4 bytes)
+            count = self.doUint(pmp, self.columns[i], self.size[i])
+        elif self.type1[i] == 0x2:  # double float (8 bytes)
+            count = self.doFloat(pmp, self.columns[i], self.size[i])
+        elif self.type1[i] == 0x3:  # unsigned char (1 byte)
+            count = self.doByte(pmp, self.columns[i], self.size[i])
+        elif self.type1[i] == 0x4:  # unsigned long (8 bytes)
+            count = self.doUlong(pmp, self.columns[i], self.size[i])
+        elif self.type1[i] == 0x5:  # unsigned short (2 bytes)
+            count = self.doUshort(pmp, self.columns[i], self.size[i])
+        elif self.type1[i] == 0x6:  # null terminated strings
+            count = self.doStrings(pmp, self.columns[i])
+        elif self.type1[i] == 0x7:  # unsigned integers (4 bytes)
+            count = self.doUint(pmp, self.columns[i], self.size[i])
+        else:
+            raise PmpTypeError("unknown type: %d" % self.type1[i])
+
+        self.checkSize(i, count)
+
+        if self.cache is not None:
+            self.toCache(i)
+
+
+
+    def doColumns(self, workers):
+        '''
+
+        Read the data for all columns that are not in self.cache with
+        'workers' threads.  Threads rather than processes for the string
+        columns too:  splitting them is one str.split() call, far cheaper
+        than pickling the list back from another process.  The results are
+        stored the same way as doColumn() does.
+
+        '''
+
+        jobs = []
+        for i in range(len(self.columns)):
+            if self.type1[i] not in _ARRAY and self.type1[i] not in (0x0, 0x6):
                 raise PmpTypeError("unknown type: %d" % self.type1[i])
+            if self.cache is not None and self.fromCache(i):
+                continue
+            jobs.append(i)
+
+        threads = multiprocessing.pool.ThreadPool(workers)
+        try:
+            results = zip(jobs, threads.map(_readColumn,
+                [(self.files[i], self.type1[i], self.size[i],
+                  self.packStrings) for i in jobs]))
+        finally:
+            threads.close()
+            threads.join()
 
-            if count == None:
-                count = 0
+        for i, col in results:
+            self.data[self.columns[i]] = col
+            self.checkSize(i, len(col))
+            if self.cache is not None:
+                self.toCache(i)
 
-            if count != self.size[i]:
-                raise PmpSizeError(
-                    "expected %d entries in %s/%s" %
-                    (self.size[i], self.tableName, self.columns[i]),
-                    " but read", count)
 
-            i += 1
+
+    def fromCache(self, i):
+        '''Load column i from self.cache.  Returns False on a cache miss'''
+
+        payload = self.cache.load(self.files[i])
+        if payload is None:
+            return False
+
+        # string columns are cached in the form they were read in, turn
+        # them into the one this table uses (see packStrings)
+        kind = payload[0]
+        if kind == 'a':  # fixed width array
+            col = array.array(payload[1])
+            col.fromstring(payload[2])
+        elif kind == 'p' and self.packStrings:  # packed strings
+            col = _PmpStrings(payload[1], offsets=payload[2])
+        elif kind == 'p':
+            col = _PmpStrings(payload[1], offsets=payload[2])[:]
+        elif payload[1] == 0:  # list of strings
+            col = _PmpStrings("") if self.packStrings else []
+        elif self.packStrings:
+            col = _PmpStrings(payload[2] + chr(0))
+        else:
+            col = payload[2].split(chr(0))
+
+        self.checkSize(i, len(col))
+        self.data[self.columns[i]] = col
+        return True
+
+
+
+    def toCache(self, i):
+        '''Save the decoded column i in self.cache'''
+
+        col = self.data[self.columns[i]]
+        if isinstance(col, array.array):
+            payload = ('a', col.typecode, col.tostring())
+        elif isinstance(col, _PmpStrings):
+            payload = ('p', col.buf, col.offsets.tostring())
+        else:
+            payload = ('s', len(col), chr(0).join(col))
+
+        # stamped with the file as it was when it was read
+        self.cache.save(self.files[i], payload, self.stamps[i])
+
+
+
+    def checkSize(self, i, count):
+        '''Verify that column i holds the number of entries in its header'''
+
+        if count == None:
+            count = 0
+
+        if count != self.size[i]:
+            raise PmpSizeError(
+                "expected %d entries in %s/%s" %
+                (self.size[i], self.tableName, self.columns[i]),
+                " but read", count)
+
+
+
+    def loadColumn(self, i):
+        '''
+        Load column i of a lazy table and return it.
+
+        Fixed width columns (types 0x1-0x5, 0x7) are memory mapped and
+        returned as a read only view of the file.  Packed string columns
+        are memory mapped too, other strings are decoded into data[] the
+        same way as the full table read.
+
+        '''
+
+        pmp = open(self.files[i], "rb")
+        try:
+            if self.packStrings and self.type1[i] in (0x0, 0x6):
+                buf = mmap.mmap(pmp.fileno(), 0, access=mmap.ACCESS_READ)
+                col = _PmpStrings(buf, _HEADER_SIZE)
+                self.checkSize(i, len(col))
+                self.maps[self.columns[i]] = buf
+                self.data[self.columns[i]] = col
+            elif self.type1[i] in _FIXED:
+                buf = mmap.mmap(pmp.fileno(), 0, access=mmap.ACCESS_READ)
+                col = _PmpColumn(buf, _FIXED[self.type1[i]], 0)
+                col.count = (len(buf) - _HEADER_SIZE) // col.width
+                self.checkSize(i, col.count)
+                self.maps[self.columns[i]] = buf
+                self.data[self.columns[i]] = col
+            else:
+                pmp.seek(_HEADER_SIZE)
+                self.doColumn(pmp, i)
+        finally:
             pmp.close()
 
+        return self.data[self.columns[i]]
 
 
 
-    def doHeader(self, pmp, i):
+    def refresh(self):
         '''
-        read and verify the pmp file header:
+        Re-read the columns whose pmp file changed (size or mtime) since
+        they were read.  Returns a summary of what changed:
 
-        magic------|type1|c1---|c2---------|type2|size----------|
-        3f cc cc cd|T1 T1|13 32|00 00 00 02|T2 T2|SS SS SS SS SS|
+            { 'columns':[ 'caption', ... ], 'rows':{ 'caption':12, ... } }
+
+        where rows is the change in the number of entries of each reloaded
+        column.  Columns of a lazy table that were not loaded yet only have
+        their header re-read.
 
         '''
 
-        self.magic.append(struct.unpack("I", pmp.read(4))[0])
-        self.type1.append(struct.unpack("H", pmp.read(2))[0])
-        self.c1.append(struct.unpack("H", pmp.read(2))[0])
-        self.c2.append(struct.unpack("I", pmp.read(4))[0])
-        self.type2.append(struct.unpack("H", pmp.read(2))[0])
-        self.c4.append(struct.unpack("H", pmp.read(2))[0])
-        self.size.append(struct.unpack("I", pmp.read(4))[0])
+        reloaded = []
+        rows = {}
 
-        if self.magic[i] != 0x3fcccccd:
-            raise PmpMagicError(
-                "failed magic: (0x3fcccccd) %#x" % self.magic[i])
+        for i in range(len(self.columns)):
+            st = os.stat(self.files[i])
+            if (st.st_size, st.st_mtime) == self.stamps[i]:
+                continue
 
-        if self.c1[i] != 0x1332:
-            raise PmpMagicError("failed c1: (0x1332) %#x" % self.c1[i])
+            column = self.columns[i]
+            oldSize = self.size[i]
+            self.times.pop(column, None)
 
-        if self.c2[i] != 0x00000002:
-            raise PmpMagicError("failed c1: (0x00000002) %#x" % self.c2[i])
+            loaded = dict.__contains__(self.data, column)
+            if column in self.maps:
+                del self.data[column]
+                self.maps.pop(column).close()
 
-        if self.c4[i] != 0x1332:
-            raise PmpMagicError("failed c4: (0x1332) %#x" % self.c4[i])
+            pmp = open(self.files[i], "rb")
+            try:
+                self.doHeader(pmp, i)
+                if not self.lazy:
+                    self.doColumn(pmp, i)
+            finally:
+                pmp.close()
 
-        if self.type1[i] != self.type2[i]:
-            raise PmpTypeError(
-                "type1 (%#x) not equal to type2 (%#x)" %
-                (self.type1[i], self.type2[i]))
+            if self.lazy and loaded:
+                dict.pop(self.data, column, None)
+                self.loadColumn(i)
 
+            reloaded.append(column)
+            rows[column] = self.size[i] - oldSize
 
+        return {'columns': reloaded, 'rows': rows}
 
-    def doStrings(self, pmp, columnName):
-        '''Read null terminated strings into dictionary data[columnName][x]'''
-
-        self.data[columnName] = []
-        sValue = ""
-        while True:
-            b = pmp.read(1)
-            if len(b) == 0:  # EOF
-                return len(self.data[columnName])
-            elif b == chr(0):  # EOS
-                self.data[columnName].append(sValue)
-                sValue = ""
+
+
+    def close(self):
+        '''Release the memory mapped files of a lazy table'''
+
+        for column in self.maps.keys():
+            del self.data[column]
+            self.maps.pop(column).close()
+
+
+
+    def doHeader(self, pmp, i):
+        '''
+        read and verify the pmp file header (see readHeader()) and save it
+        as entry i of magic[], type1[], etc.  The size and mtime of the file
+        are saved in stamps[i] for refresh().
+
+        '''
+
+        header = readHeader(pmp)
+        fields = (self.magic, self.type1, self.c1, self.c2, self.type2,
+                  self.c4, self.size)
+
+        for field, value in zip(fields, header):
+            if i < len(field):  # re-read by refresh()
+                field[i] = value
             else:
-                sValue += b
+                field.append(value)
+
+        st = os.fstat(pmp.fileno())
+        if i < len(self.stamps):
+            self.stamps[i] = (st.st_size, st.st_mtime)
+        else:
+            self.stamps.append((st.st_size, st.st_mtime))
+
+
+
+    def doStrings(self, pmp, columnName):
+        '''
+        Read null terminated strings into dictionary data[columnName][x]
+
+        The rest of the file is read at once and split on the nulls.  Any
+        characters after the last null are not a complete string and are
+        dropped.
+
+        '''
+
+        body = pmp.read()
+        if self.packStrings:
+            self.data[columnName] = _PmpStrings(body)
+        else:
+            self.data[columnName] = body.split(chr(0))[:-1]
+        return len(self.data[columnName])
 
 
 
@@ -352,6 +920,73 @@ class PmpInfo(object):
 
 
 
+    def variantTimes(self, values):
+        '''
+        Convert a whole sequence of variant times (see variantTime()) at
+        once.  Returns the times as seconds since 1970-01-01 00:00 in an
+        array('d'), or, if values is a numpy array, as a numpy datetime64[s]
+        array.
+
+        The result matches variantTime() to the second, including the
+        handling of negative fractional days, without creating a datetime
+        for every value.
+
+        '''
+
+        epoch = 693594 - 719163  # 1899 Dec 30 in days from 1970 Jan 1
+
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            varT = values.astype(numpy.float64)
+            newTime, days = numpy.modf(varT)
+            newTime[newTime < 0] += 1.0
+            t, hours = numpy.modf(24.0 * newTime)
+            t, minutes = numpy.modf(60.0 * t)
+            seconds = numpy.trunc(60.0 * t)
+            ret = (days + epoch) * 86400.0 + hours * 3600.0 + \
+                minutes * 60.0 + seconds
+            return ret.astype(numpy.int64).astype('datetime64[s]')
+
+        modf = math.modf
+        ret = array.array('d', [0.0]) * len(values)
+        for i, varT in enumerate(values):
+            newTime, days = modf(varT)
+            if newTime < 0:
+                newTime = 1.0 + newTime
+            t, hours = modf(24.0 * newTime)
+            t, minutes = modf(60.0 * t)
+            ret[i] = (days + epoch) * 86400.0 + hours * 3600.0 + \
+                minutes * 60.0 + int(60.0 * t)
+
+        return ret
+
+
+
+    def getTime(self, column, index):
+        '''
+        Return the variant time in data[column][index] as an ISO date/time
+        string, the same as variantTime(), or None if there is no such
+        entry.
+
+        The first call for a column converts the whole column with
+        variantTimes() and keeps the result in self.times.
+
+        '''
+
+        if column not in self.times:
+            try:
+                self.times[column] = self.variantTimes(self.data[column])
+            except (KeyError, TypeError):
+                return None
+
+        try:
+            seconds = self.times[column][index]
+        except IndexError:
+            return None
+
+        return (_EPOCH + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+
     def colSizes(self):
         '''Return a list of tuples [ (columname, size), (...), ... ] '''
 
@@ -380,6 +1015,139 @@ class PmpInfo(object):
         return zip(self.columns, ret)
 
 
+    def iterRows(self, columns=None, start=0, stop=None, named=True):
+        '''
+        Iterate over the rows start to stop-1 of the table (all of them by
+        default).  Each row is a namedtuple of the values of 'columns' (a
+        list of column names, default all columns):
+
+            for row in pmp.iterRows(["caption", "lat", "long"]):
+                print row.caption, row.lat, row.long
+
+        Column names that are not valid Python identifiers are renamed to
+        _0, _1, ... (see collections.namedtuple), so use named=False to get
+        plain tuples instead.  Like getEntry(), a row past the end of a
+        column gets an empty string for that column.
+
+        The rows are built as they are requested, on a lazy table opened
+        with packStrings=True nothing but the offsets of the string columns
+        is held in memory no matter how big the table is.
+
+        '''
+
+        if columns is None:
+            columns = self.columns
+
+        sizes = [self.size[self.columns.index(column)] for column in columns]
+        if stop is None:
+            stop = max(sizes) if sizes else 0
+
+        iters = []
+        for column, size in zip(columns, sizes):
+            col = self.data[column]
+            end = max(start, min(stop, size))
+            if hasattr(col, 'iterRange'):
+                values = col.iterRange(start, end)
+            else:
+                values = itertools.islice(col, start, end)
+            iters.append(itertools.chain(values,
+                                         itertools.repeat("", stop - end)))
+
+        rows = itertools.izip(*iters)
+        if named:
+            Row = collections.namedtuple('Row', columns, rename=True)
+            rows = itertools.imap(Row._make, rows)
+
+        return rows
+
+
+
+    def fixedColumns(self, columns=None):
+        '''
+        Return the indexes of 'columns' (default all fixed width columns),
+        raising PmpTypeError if one of them is a string column.
+
+        '''
+
+        if columns is None:
+            return [i for i in range(len(self.columns))
+                    if self.type1[i] in _DTYPE]
+
+        ret = []
+        for column in columns:
+            i = self.columns.index(column)
+            if self.type1[i] not in _DTYPE:
+                raise PmpTypeError("%s is not a fixed width column (type %#x)"
+                                   % (column, self.type1[i]))
+            ret.append(i)
+        return ret
+
+
+
+    def toNumpy(self, columns=None):
+        '''
+        Return a dictionary of the fixed width columns (types 0x1-0x5, 0x7)
+        as numpy arrays: { 'lat':array([...]), 'long':array([...]), ... }
+
+        Nothing is copied:  loaded columns are wrapped with numpy.frombuffer()
+        and the columns of a lazy table are opened with numpy.memmap(), so
+        the arrays stay valid after close() or refresh().  Treat them as
+        read only.
+
+        If numpy is not installed the columns themselves (array.array or,
+        for a lazy table, the memory mapped views) are returned instead.
+
+        '''
+
+        ret = {}
+        for i in self.fixedColumns(columns):
+            column = self.columns[i]
+
+            if numpy is None:
+                ret[column] = self.data[column]
+            elif column in self.maps or (self.lazy and
+                    not dict.__contains__(self.data, column)):
+                # a map of our own, not self.maps[column], which close() and
+                # refresh() close while the array may still be in use
+                ret[column] = numpy.memmap(self.files[i],
+                    _DTYPE[self.type1[i]], 'r', _HEADER_SIZE, (self.size[i],))
+            else:
+                ret[column] = numpy.frombuffer(self.data[column],
+                                               _DTYPE[self.type1[i]])
+
+        return ret
+
+
+
+    def asStructured(self, columns=None):
+        '''
+        Return the fixed width columns as one numpy structured array with a
+        field per column, aligned on the row index:
+
+            geo = pmp.asStructured(["lat", "long"])
+            print geo[500]["lat"], geo["long"].mean()
+
+        The array has as many rows as the longest column, rows past the end
+        of a shorter column are 0.  Unlike toNumpy() this copies the data.
+        Raises PmpError if numpy is not installed.
+
+        '''
+
+        if numpy is None:
+            raise PmpError("asStructured() needs numpy")
+
+        indexes = self.fixedColumns(columns)
+        rows = max([self.size[i] for i in indexes]) if indexes else 0
+        ret = numpy.zeros(rows, [(self.columns[i], _DTYPE[self.type1[i]])
+                                 for i in indexes])
+        for column, values in self.toNumpy(
+                [self.columns[i] for i in indexes]).iteritems():
+            ret[column][:len(values)] = values
+
+        return ret
+
+
+
     def getCol(self, column, index):
         '''
         Return a value from the data dictionary
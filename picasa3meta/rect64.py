@@ -0,0 +1,151 @@
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+'''
+
+# decoded rectangles: { 64 bit value:(x1, y1, x2, y2), ... }
+_cache = {}
+
+# forget everything once the cache gets this big
+_CACHE_MAX = 1000000
+
+_MAX = float(0xffff)
+
+
+def value(rect):
+    '''
+
+    Return the 64 bit value of a rect64.  rect may be a number, a hex
+    string or a "rect64(<hex>)" string.  Returns None if rect is empty or
+    cannot be parsed.
+
+    '''
+
+    if isinstance(rect, (int, long)):
+        return rect
+
+    rect = rect.strip()
+    if rect.startswith("rect64(") and rect.endswith(")"):
+        rect = rect[7:-1]
+    try:
+        return long(rect, 16)
+    except ValueError:
+        return None
+
+
+
+def decode(rect):
+    '''
+
+    Return the rect64 rect (see value()) as a tuple of floats:
+
+        (x1, y1, x2, y2)
+
+    normalized to 0.0 - 1.0.  Returns None if rect cannot be parsed.
+
+    Picasa3 stores crop and face rectangles as a 64 bit number, usually
+    written as rect64(<up to 16 hex digits>) in .picasa.ini files:
+
+        crop=rect64(5bf05d4f9bcfad1)
+        faces=rect64(3f845bcb59418507),e1363a4accda66d5;rect64(...),...
+
+    The number is four 16 bit values, the upper left x,y and the lower
+    right x,y of the rectangle, each scaled so that 0xffff is the full
+    width or height of the image:
+
+        |x1---|y1---|x2---|y2---|
+        |xx xx|xx xx|xx xx|xx xx|
+
+    Usage:
+
+        from picasa3meta import rect64
+
+        print rect64.decode("rect64(5bf05d4f9bcfad1)")
+
+    Decoded rectangles are remembered by their 64 bit value, so the same
+    rectangle (i.e. a face in duplicate images) is only decoded once.
+
+    '''
+
+    key = value(rect)
+    if key is None:
+        return None
+
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+
+    if len(_cache) >= _CACHE_MAX:
+        _cache.clear()
+
+    ret = _cache[key] = (((key >> 48) & 0xffff) / _MAX,
+                         ((key >> 32) & 0xffff) / _MAX,
+                         ((key >> 16) & 0xffff) / _MAX,
+                         (key & 0xffff) / _MAX)
+    return ret
+
+
+
+def decodeMany(rects):
+    '''
+
+    Decode a sequence of rect64s (i.e. a whole imagedata_crop64 column).
+    Returns a list of (x1, y1, x2, y2) tuples, or None for entries that
+    cannot be parsed.
+
+    '''
+
+    cache = _cache
+    ret = []
+    for rect in rects:
+        try:
+            ret.append(cache[rect])
+        except (KeyError, TypeError):
+            ret.append(decode(rect))
+
+    return ret
+
+
+
+def decodeFaces(faces):
+    '''
+
+    Decode a faces list as written in .picasa.ini:
+
+        rect64(3f845bcb59418507),e1363a4accda66d5;rect64(...),...
+
+    Returns a list of ((x1, y1, x2, y2), contact_id) tuples.  Faces whose
+    rectangle cannot be parsed are left out.
+
+    '''
+
+    ret = []
+    for face in faces.split(';'):
+        rect, sep, contact = face.partition(',')
+        rect = decode(rect)
+        if rect is not None:
+            ret.append((rect, contact))
+
+    return ret
+
+
+
+def clearCache():
+    '''Forget all decoded rectangles'''
+
+    _cache.clear()
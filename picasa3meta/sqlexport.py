@@ -0,0 +1,389 @@
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+'''
+
+import itertools
+import os
+import sqlite3
+
+from picasa3meta import contacts, iniinfo
+
+# SQLite column type of each pmp column type (see PmpInfo.doHeader())
+_SQLTYPE = {
+    0x0: 'TEXT',     # null terminated strings
+    0x1: 'INTEGER',  # unsigned integers (4 bytes)
+    0x2: 'REAL',     # double float (8 bytes)
+    0x3: 'INTEGER',  # unsigned char (1 byte)
+    0x4: 'INTEGER',  # unsigned long (8 bytes), stored as signed
+    0x5: 'INTEGER',  # unsigned short (2 bytes)
+    0x6: 'TEXT',     # null terminated strings
+    0x7: 'INTEGER',  # unsigned integers (4 bytes)
+}
+
+
+def _quote(name):
+    '''Quote a table or column name (pmp columns may contain '@' etc.)'''
+
+    return '"%s"' % name.replace('"', '""')
+
+def _text(value):
+    '''Return a pmp/ini string as unicode (utf-8, or else latin-1)'''
+
+    if value is None or isinstance(value, unicode):
+        return value
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('latin-1')
+
+def _signed(value):
+    '''Return an unsigned 64 bit value as the signed value SQLite can hold'''
+
+    if value >= 1 << 63:
+        return value - (1 << 64)
+    return value
+
+# conversion of the values of each pmp column type, if any
+_CONVERT = {0x0: _text, 0x4: _signed, 0x6: _text}
+
+
+
+class SqlExport(object):
+    '''
+
+    Export the Picasa3 metadata to an SQLite database:
+
+        <table>:   one row per pmp table entry (i.e. imagedata), the
+                   columns of the pmp table plus 'entry' and the full
+                   'path' name of the image from thumbindex.db
+        ini:       (dir, path, key, value) of every .picasa.ini entry
+        faces:     (dir, path, person) of every face in the .picasa.ini
+                   files, person is the contact id
+        contacts:  (id, name) of every contact in contacts.xml
+        sources:   (file, size, mtime) of every file exported
+
+    Usage:
+
+        from picasa3meta import pmpinfo, sqlexport, thumbindex
+
+        db = thumbindex.ThumbIndex("/path/to/Picasa3/db3/thumbindex.db")
+        pmp = pmpinfo.PmpInfo("/path/to/Picasa3/db3", "imagedata")
+
+        out = sqlexport.SqlExport("/path/to/picasa.sqlite")
+        out.export(pmp, db, "/path/to/photos", "/path/to/contacts.xml")
+        out.close()
+
+    Each export() is a single transaction.  Rows are inserted with
+    executemany() and the indexes are created after the data is loaded.
+
+    Exporting again into the same database is incremental: only the
+    sources whose size or mtime differ from the sources table are looked
+    at, and of a changed pmp column only the rows whose value changed are
+    updated.
+
+    '''
+
+    def __init__(self, fileName, indexes=("path", "personalbumid", "date")):
+        '''
+
+        Open (or create) the SQLite database fileName.  indexes is the list
+        of the columns of the pmp table to index, if the table has them.
+
+        '''
+
+        self.fileName = fileName
+        self.indexes = indexes
+        self.conn = sqlite3.connect(fileName)
+
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sources '
+                          '(file TEXT PRIMARY KEY, size INTEGER, mtime REAL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS ini '
+                          '(dir TEXT, path TEXT, key TEXT, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS faces '
+                          '(dir TEXT, path TEXT, person TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS contacts '
+                          '(id TEXT PRIMARY KEY, name TEXT)')
+        self.conn.commit()
+
+
+
+    def close(self):
+        '''Close the database'''
+
+        self.conn.close()
+
+
+
+    def export(self, pmp, db=None, root=None, contactsFile=None):
+        '''
+
+        Export pmp (a PmpInfo), the paths in db (a ThumbIndex), the
+        .picasa.ini files under root and contactsFile, whichever are
+        given, in one transaction.  Then create the indexes.  Returns a
+        summary of what was written:
+
+            { 'rows':n, 'updated':{ 'caption':n, ... }, 'ini':n,
+              'contacts':n }
+
+        rows is the number of rows inserted (or deleted, if negative) in
+        the pmp table, updated the number of rows changed of each column,
+        ini the number of .picasa.ini files (re)exported and contacts the
+        number of contacts (if contacts.xml was exported again).
+
+        '''
+
+        summary = {'rows': 0, 'updated': {}, 'ini': 0, 'contacts': 0}
+
+        try:
+            summary.update(self.exportTable(pmp, db))
+            if root is not None:
+                summary['ini'] = self.exportIni(root)
+            if contactsFile is not None:
+                summary['contacts'] = self.exportContacts(contactsFile)
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+
+        self.buildIndexes(pmp.tableName)
+        return summary
+
+
+
+    def changed(self, srcFile, stamp=None):
+        '''
+
+        Return True if srcFile (with stamp (size, mtime), default its
+        current one) is not in the sources table or has a different
+        stamp there, and record the new stamp.
+
+        '''
+
+        if stamp is None:
+            st = os.stat(srcFile)
+            stamp = (st.st_size, st.st_mtime)
+        srcFile = _text(srcFile)
+
+        old = self.conn.execute('SELECT size, mtime FROM sources '
+                                'WHERE file = ?', (srcFile,)).fetchone()
+        if old is not None and tuple(old) == tuple(stamp):
+            return False
+
+        self.conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)',
+                          (srcFile, stamp[0], stamp[1]))
+        return True
+
+
+
+    def columnValues(self, pmp, column, count):
+        '''
+
+        Iterate over the first 'count' values of a pmp column converted
+        for SQLite, None past the end of the column.
+
+        '''
+
+        i = pmp.columns.index(column)
+        data = pmp.data[column]
+        size = min(pmp.size[i], count)
+
+        if hasattr(data, 'iterRange'):
+            values = data.iterRange(0, size)
+        else:
+            values = itertools.islice(data, 0, size)
+        if pmp.type1[i] in _CONVERT:
+            values = itertools.imap(_CONVERT[pmp.type1[i]], values)
+
+        return itertools.chain(values, itertools.repeat(None, count - size))
+
+
+
+    def pathValues(self, db, count):
+        '''Iterate over the full path names of the first 'count' entries'''
+
+        for i in xrange(count):
+            if i < db.entries and db.pathIndex[i] != 0xffffffff:
+                yield _text(db.imageFullName(i))
+            else:
+                yield None
+
+
+
+    def exportTable(self, pmp, db=None):
+        '''
+
+        Export the pmp table, with the paths of its entries from db if
+        given.  A new table is loaded with one executemany(), an existing
+        one only has the columns of changed sources compared and updated.
+
+        '''
+
+        table = _quote(pmp.tableName)
+        columns = ["path"] + pmp.columns
+
+        count = max(pmp.size + ([db.entries] if db is not None else [0]))
+
+        self.conn.execute('CREATE TABLE IF NOT EXISTS %s '
+                          '(entry INTEGER PRIMARY KEY, path TEXT)' % table)
+        have = [row[1] for row in
+                self.conn.execute('PRAGMA table_info(%s)' % table)]
+        for i, column in enumerate(pmp.columns):
+            if column not in have:
+                self.conn.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                    (table, _quote(column), _SQLTYPE.get(pmp.type1[i], '')))
+
+        # the sources that changed since the last export
+        todo = [column for i, column in enumerate(pmp.columns)
+                if self.changed(pmp.files[i], pmp.stamps[i])]
+        if db is not None and self.changed(db.fileName, db.stamp):
+            todo.insert(0, "path")
+
+        def values(column):
+            if column == "path":
+                if db is None:
+                    return itertools.repeat(None, count)
+                return self.pathValues(db, count)
+            return self.columnValues(pmp, column, count)
+
+        rows = self.conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+
+        if rows == 0:
+            # a new table, insert everything at once
+            self.conn.executemany('INSERT INTO %s (entry, %s) VALUES (%s)' %
+                (table, ", ".join([_quote(c) for c in columns]),
+                 ", ".join(["?"] * (len(columns) + 1))),
+                itertools.izip(xrange(count), *[values(c) for c in columns]))
+            return {'rows': count,
+                    'updated': dict.fromkeys(columns, count)}
+
+        if count > rows:
+            self.conn.executemany('INSERT INTO %s (entry) VALUES (?)' % table,
+                                  ((i,) for i in xrange(rows, count)))
+        elif count < rows:
+            self.conn.execute('DELETE FROM %s WHERE entry >= ?' % table,
+                              (count,))
+
+        updated = {}
+        for column in todo:
+            old = self.conn.execute('SELECT %s FROM %s ORDER BY entry' %
+                                    (_quote(column), table))
+            changes = [(new, i) for i, ((value,), new) in
+                       enumerate(itertools.izip(old, values(column)))
+                       if value != new]
+            self.conn.executemany('UPDATE %s SET %s = ? WHERE entry = ?' %
+                                  (table, _quote(column)), changes)
+            updated[column] = len(changes)
+
+        return {'rows': count - rows, 'updated': updated}
+
+
+
+    def exportIni(self, root, iniName=".picasa.ini"):
+        '''
+
+        Export the .picasa.ini files under root that changed since the last
+        export, and drop the ones that are gone.  Returns the number of
+        files exported.
+
+        '''
+
+        done = 0
+        seen = set()
+
+        for iniFile in iniinfo.findIni(root, iniName):
+            seen.add(_text(iniFile))
+            if not self.changed(iniFile):
+                continue
+
+            path = _text(os.path.dirname(iniFile))
+            self.conn.execute('DELETE FROM ini WHERE dir = ?', (path,))
+            self.conn.execute('DELETE FROM faces WHERE dir = ?', (path,))
+
+            try:
+                myIni = iniinfo.IniInfo(iniFile)
+            except (iniinfo.IniError, IOError):
+                continue
+
+            pairs = []
+            faces = []
+            for image in myIni.names:
+                fullName = os.path.join(path, _text(image))
+                for key, value in myIni.getFilePairs(image):
+                    pairs.append((path, fullName, _text(key), _text(value)))
+                for rect, person in myIni.getFaces(image) or []:
+                    faces.append((path, fullName, _text(person)))
+
+            self.conn.executemany('INSERT INTO ini VALUES (?, ?, ?, ?)', pairs)
+            self.conn.executemany('INSERT INTO faces VALUES (?, ?, ?)', faces)
+            done += 1
+
+        # the .picasa.ini files that were removed (compared here rather than
+        # with LIKE, which ignores case and treats '_' and '%' as wildcards)
+        root = _text(os.path.join(os.path.abspath(root), ""))
+        tail = _text(os.sep + iniName)
+        for (iniFile,) in self.conn.execute(
+                'SELECT file FROM sources').fetchall():
+            if iniFile.startswith(root) and iniFile.endswith(tail) and \
+                    iniFile not in seen:
+                path = _text(os.path.dirname(iniFile))
+                self.conn.execute('DELETE FROM ini WHERE dir = ?', (path,))
+                self.conn.execute('DELETE FROM faces WHERE dir = ?', (path,))
+                self.conn.execute('DELETE FROM sources WHERE file = ?',
+                                  (iniFile,))
+
+        return done
+
+
+
+    def exportContacts(self, contactsFile):
+        '''
+
+        Export contactsFile if it changed since the last export.  Returns
+        the number of contacts exported.
+
+        '''
+
+        if not self.changed(contactsFile):
+            return 0
+
+        mapping = contacts.Contacts(contactsFile).handler.mapping
+        self.conn.execute('DELETE FROM contacts')
+        self.conn.executemany('INSERT INTO contacts VALUES (?, ?)',
+            [(_text(cid), _text(name)) for cid, name in mapping.iteritems()])
+        return len(mapping)
+
+
+
+    def buildIndexes(self, tableName):
+        '''Create the indexes that do not exist yet'''
+
+        have = [row[1] for row in
+                self.conn.execute('PRAGMA table_info(%s)' % _quote(tableName))]
+
+        for column in self.indexes:
+            if column in have:
+                self.conn.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' %
+                    (_quote("%s_%s" % (tableName, column)),
+                     _quote(tableName), _quote(column)))
+
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ini_path ON ini (path)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS faces_path '
+                          'ON faces (path)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS faces_person '
+                          'ON faces (person)')
+        self.conn.commit()
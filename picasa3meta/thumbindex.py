@@ -19,7 +19,18 @@ Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
 '''
 
 import array
+import bisect
+import collections
+import fnmatch
+import gc
+import itertools
+import operator
 import os
+import re
+
+# a thumbindex.db entry: the file/path name terminated by a null (or 0xff),
+# 26 unknown bytes and the 4 byte path index
+_ENTRY = re.compile('([^\\x00\\xff]*)[\\x00\\xff](.{30})', re.S)
 
 
 class ThumbError(Exception):
@@ -31,6 +42,183 @@ class    MagicError(ThumbError):
 class   ThumbIndexError(ThumbError):
     pass
 
+class _Records(object):
+    '''
+    Fixed size records kept back to back in one string.  Each record is
+    returned as an array('B').
+
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.data = ""
+
+    def extend(self, data):
+        self.data += data
+
+    def __len__(self):
+        return len(self.data) // self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("record index out of range")
+        return array.array('B',
+            self.data[index * self.size:(index + 1) * self.size])
+
+class _Names(object):
+    '''
+
+    The file/path names of all entries kept back to back in one string,
+    with an array of where each one starts.  names[i] returns the name of
+    entry i as a new string.
+
+    '''
+
+    def __init__(self):
+        self.data = ""
+        self.offsets = array.array('I', [0])
+
+    def extend(self, names):
+        '''Add a list of names'''
+        total = self.offsets[-1]
+        offsets = array.array('I', [0]) * len(names)
+        for i, length in enumerate(itertools.imap(len, names)):
+            total += length
+            offsets[i] = total
+        self.data += "".join(names)
+        self.offsets.extend(offsets)
+
+    def extendPacked(self, data, offsets):
+        '''Add names already packed (data and offsets of another _Names)'''
+        base = self.offsets[-1]
+        more = array.array('I')
+        more.fromstring(offsets)
+        if base:
+            more = array.array('I', [o + base for o in more])
+        self.data += data
+        self.offsets.extend(more[1:])
+
+    def empty(self, first=0):
+        '''Iterate over True/False for each name from 'first' on: is it ""?'''
+        return itertools.imap(operator.eq,
+            itertools.islice(self.offsets, first, None),
+            itertools.islice(self.offsets, first + 1, None))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("name index out of range")
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        data = self.data
+        for start, stop in itertools.izip(self.offsets,
+                itertools.islice(self.offsets, 1, None)):
+            yield data[start:stop]
+
+class _LRU(object):
+    '''A dictionary that only keeps the 'size' most recently used keys'''
+
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+
+    def get(self, key):
+        '''Return the value of key, or None'''
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            return None
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+class _Children(object):
+    '''
+
+    The child entries of each parent entry, stored as three arrays:
+
+        parents: the sorted indexes of the entries that have children
+        offsets: children of parents[n] are entries[offsets[n]:offsets[n + 1]]
+        entries: the indexes of the child entries
+
+    Used for the faces of each image (faces are entries in thumbindex.db
+    without a name whose path index is the image they are in) and for the
+    files of each directory.  This behaves like the read only dictionary
+
+        { parent_index:[ child1_index, child2_index, ...], ... }
+
+    but holds each child in 4 bytes instead of a list slot and an int.
+
+    '''
+
+    def __init__(self, children, parentIndex):
+        children = [i for i in children if parentIndex[i] != 0xffffffff]
+        children.sort(key=parentIndex.__getitem__)  # stable, keeps order
+
+        self.parents = array.array('I')
+        self.offsets = array.array('I')
+        self.entries = array.array('I', children)
+
+        last = None
+        for n, i in enumerate(children):
+            if parentIndex[i] != last:
+                last = parentIndex[i]
+                self.parents.append(last)
+                self.offsets.append(n)
+        self.offsets.append(len(children))
+
+    def find(self, image):
+        '''Return the position of image in parents[] or -1'''
+        n = bisect.bisect_left(self.parents, image)
+        if n < len(self.parents) and self.parents[n] == image:
+            return n
+        return -1
+
+    def __getitem__(self, image):
+        n = self.find(image)
+        if n < 0:
+            raise KeyError(image)
+        return self.entries[self.offsets[n]:self.offsets[n + 1]]
+
+    def get(self, image, default=None):
+        n = self.find(image)
+        if n < 0:
+            return default
+        return self.entries[self.offsets[n]:self.offsets[n + 1]]
+
+    def __contains__(self, image):
+        return self.find(image) >= 0
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __iter__(self):
+        return iter(self.parents)
+
+    def keys(self):
+        return list(self.parents)
+
+    def iteritems(self):
+        for n, image in enumerate(self.parents):
+            yield image, self.entries[self.offsets[n]:self.offsets[n + 1]]
+
+    def items(self):
+        return list(self.iteritems())
+
 class ThumbIndex(object):
     '''
     Read the Picasa3 thumbindex.db file, verify the magic byte and save
@@ -47,9 +235,27 @@ class ThumbIndex(object):
 
         db = thumbindex.ThumbIndex("/path/to/Picasa3/db3/thumbindex.db")
 
+        # or keep a parsed copy in a dbcache.DbCache for the next time
+        db = thumbindex.ThumbIndex("/path/to/Picasa3/db3/thumbindex.db",
+                                   dbcache.DbCache("/path/to/cache"))
+
         # find index of image.jpg data in Picasa3 imagedata_xxx.pmp files
         pmpIndex = db.indexOfFile("/full/path/to/Picasa3/image.jpg")
 
+        # or the indexes of many files at once
+        pmpIndexes = db.indexOfFiles(["/path/to/a.jpg", "/path/to/b.jpg"])
+
+        # the indexes of every file in and below /photos/2011
+        pmpIndexes = db.entriesUnder("/photos/2011/")
+
+        # or just the jpegs, by basename or by full path name
+        pmpIndexes = db.locate("*.jpg", "/photos/2011/")
+        pmpIndexes = db.glob("/photos/20??/*/*.jpg")
+        pmpIndexes = db.glob("/photos/2011/IMG_*.jpg")
+
+        # pick up the changes after Picasa has updated thumbindex.db
+        changes = db.refresh()
+
         # find the basename of the image file at pmpIndex
         imageName = db.imageName(pmpIndex)
 
@@ -84,24 +290,71 @@ class ThumbIndex(object):
 
     '''
 
-    def __init__(self, thumbindex):
+    def __init__(self, thumbindex, cache=None, pathCache=0):
         '''
 
         Open file "thumbindex", verify the magic byte (0x40466666), and then
         read all entries into name[], pathIndex[] arrays.
 
+        If cache is a dbcache.DbCache the entries are loaded from there
+        when thumbindex has not changed since it was cached.
+
+        name[] keeps all the names in one string (see _Names), the
+        directory entries are also kept in dirNames{}.  Full path names are
+        built when they are asked for, with pathCache=n imageFullName()
+        keeps the last n of them.
+
         '''
 
+        self.fileName = thumbindex
+        self.cache = cache
+        self.pathCache = pathCache
+        self.load()
+
+
+    def load(self):
+        '''(Re)read all the entries of self.fileName'''
+
         self.header = array.array('I')
         self.entries = 0
-        self.name = []
-        self.unknown26 = []
+        self.name = _Names()
+        self.unknown26 = _Records(26)
         self.orgPathIndex = array.array('I')
         self.pathIndex = array.array('I')
 
-        self.facesArray = {}
+        self.facesArray = _Children([], [])
+
+        # { directory_index:directory_name, ... } of all directory entries
+        self.dirNames = {}
+
+        # { (path, basename):index, ... }, built on the first lookup
+        self.fileIndex = None
+
+        # the sorted directory names, their entries and the files in each
+        # directory, built on the first prefix/glob query
+        self.dirKeys = None
+        self.dirEntries = None
+        self.dirFiles = None
 
-        self.inFile = open(thumbindex, "rb")
+        # the most recently used full path names
+        self.fullNames = _LRU(self.pathCache) if self.pathCache else None
+
+        # (size, mtime) of the file when it was read, see refresh()
+        st = os.stat(self.fileName)
+        self.stamp = (st.st_size, st.st_mtime)
+
+        if self.cache is not None:
+            payload = self.cache.load(self.fileName)
+            if payload is not None:
+                self.header.fromstring(payload[0])
+                self.entries = self.header[1]
+                self.name.extendPacked(payload[1], payload[2])
+                parents = array.array('I')
+                parents.fromstring(payload[4])
+                self.addEntries(payload[3], parents, 0)
+                return
+
+        self.inFile = open(self.fileName, "rb")
         self.header.fromfile(self.inFile, 2)
 
         if self.header[0] != 0x40466666:
@@ -109,55 +362,161 @@ class ThumbIndex(object):
 
         self.entries = self.header[1]  # number of entries I expect to find
 
-        self.index = 0
-        self.name.append("")
-
-        while True:
-            # thumb entry begins with a null terminated string which gives
-            # the filename or pathname
-            self.b = self.inFile.read(1)
-            if len(self.b) == 0:  # EOF
-                if self.index != self.entries:
-                    raise ThumbIndexError(
-                        "expected %d entries but only found %d" %
-                        (self.entries, self.index))
+        # read everything after the header at once and parse it in memory
+        data = self.inFile.read()
+        self.inFile.close()
+
+        self.doEntries(data, 0)
+        self.toCache()
+
+
+    def toCache(self):
+        '''Save the entries in self.cache (if there is one)'''
+
+        if self.cache is not None:
+            self.cache.save(self.fileName, (self.header.tostring(),
+                self.name.data, self.name.offsets.tostring(),
+                self.unknown26.data, self.orgPathIndex.tostring()),
+                self.stamp)
+
+
+    def refresh(self):
+        '''
+
+        Bring the entries up to date with thumbindex.db.  Returns a summary
+        of what changed:
+
+            { 'reloaded':True|False, 'rows':n }
+
+        If the file did not change nothing is read and rows is 0.  If the
+        file only grew (Picasa added entries at the end) just the new
+        entries are read and added, rows is the number of new entries and
+        reloaded is False.  Any other change reads the whole file again
+        and reloaded is True.
+
+        '''
+
+        st = os.stat(self.fileName)
+        if (st.st_size, st.st_mtime) == self.stamp:
+            return {'reloaded': False, 'rows': 0}
+
+        oldEntries = self.entries
+        if st.st_size > self.stamp[0]:
+            inFile = open(self.fileName, "rb")
+            try:
+                header = array.array('I')
+                header.fromfile(inFile, 2)
+                inFile.seek(self.stamp[0])
+                data = inFile.read(st.st_size - self.stamp[0])
+            finally:
+                inFile.close()
+
+            if header[0] == self.header[0] and header[1] > oldEntries:
+                self.header = header
+                self.entries = header[1]
+                try:
+                    self.doEntries(data, oldEntries)
+                except ThumbIndexError:
+                    pass  # not just new entries at the end, reload it all
                 else:
-                    return
-
-            # file/path name will terminate with a null or 0xff char
-            # 0xff? not sure where this came from but I'm going to leave it in.
-            if self.b == chr(0xff) or self.b == chr(0):
-                # self.a = self.inFile.read(26)   # toss the next 26 bytes
-                self.unknown26.append(array.array('B'))
-                self.unknown26[self.index].fromfile(self.inFile, 26)
-                # the next int is the index into the names array of the
-                # path to this file or 0xffffffff if this is a directory
-                self.pathIndex.fromfile(self.inFile, 1)
-                self.orgPathIndex.append(self.pathIndex[self.index])
-
-                if len(self.name[self.index]) == 0:
-                    # if there was no file name read then this file or
-                    # directory has been deleted.  Just set the path to
-                    # 0xffffffffff so we ignore it
-                    self.pathIndex[self.index] = 0xffffffff
-                    # now populate the facesArray dictionary --
-                    # facesArray = { image_index:[ face1_index,
-                    #                face2_index, ...], ... }
-                    #
-                    if self.orgPathIndex[self.index] != 0xffffffff:
-                        if self.facesArray.has_key(
-                                self.orgPathIndex[self.index]):
-                            self.facesArray[self.orgPathIndex[self.index]].\
-                                append(self.index)
-                        else:
-                            self.facesArray[self.orgPathIndex[self.index]] = []
-                            self.facesArray[self.orgPathIndex[self.index]].\
-                                append(self.index)
-
-                self.index += 1
-                self.name.append("")
-            else:
-                self.name[self.index] += self.b  # valid file/path name char
+                    self.stamp = (st.st_size, st.st_mtime)
+                    if self.fileIndex is not None:
+                        self.buildFileIndex(oldEntries)
+                    self.dirKeys = None  # rebuilt on the next query
+                    self.toCache()
+                    return {'reloaded': False,
+                            'rows': int(self.entries - oldEntries)}
+
+        self.load()
+        return {'reloaded': True, 'rows': int(self.entries - oldEntries)}
+
+
+    def doEntries(self, data, first):
+        '''
+
+        Parse all the entries in data into name[], pathIndex[], etc.
+        starting at entry number 'first'.  Raises ThumbIndexError unless
+        this leaves exactly self.entries entries.
+
+        The entries are split out of data by a single regular expression
+        pass, the fixed size part of each entry is then pulled apart with
+        strided slices instead of one entry at a time.
+
+        '''
+
+        # millions of small objects are created here, none of which can be
+        # part of a reference cycle, so keep the garbage collector out of it
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            entries = _ENTRY.findall(data)
+            names = [e[0] for e in entries]
+            tails = "".join([e[1] for e in entries])
+            del entries
+        finally:
+            if gcEnabled:
+                gc.enable()
+
+        count = len(names)
+        if first + count < self.entries:
+            raise ThumbIndexError(
+                "expected %d entries but only found %d" %
+                (self.entries, first + count))
+
+        if first + count > self.entries or \
+                sum(map(len, names)) + 31 * count != len(data):
+            raise ThumbIndexError(
+                "expected %d entries but found more" % self.entries)
+
+        # the 26 unknown bytes
+        unknown = bytearray(26 * count)
+        for i in range(26):
+            unknown[i::26] = tails[i::30]
+
+        # the next int is the index into the names array of the
+        # path to this file or 0xffffffff if this is a directory
+        parents = bytearray(4 * count)
+        for i in range(4):
+            parents[i::4] = tails[26 + i::30]
+
+        self.name.extend(names)
+        del names
+        self.addEntries(str(unknown), array.array('I', str(parents)), first)
+
+
+    def addEntries(self, unknown, parents, first):
+        '''
+
+        Add the entries starting at entry number 'first' whose names have
+        already been added to name[]:  the string of their 26 unknown bytes
+        and an array of their parent indexes (the raw path index).
+
+        '''
+
+        self.unknown26.extend(unknown)
+        self.orgPathIndex.extend(parents)
+        self.pathIndex.extend(parents)
+
+        # the entries without a name: deleted files/directories and faces
+        empty = list(itertools.compress(xrange(self.entries),
+                                        self.name.empty()))
+
+        for i in empty[bisect.bisect_left(empty, first):]:
+            # if there was no file name read then this file or
+            # directory has been deleted.  Just set the path to
+            # 0xffffffffff so we ignore it
+            self.pathIndex[i] = 0xffffffff
+
+        # the directory names are shared by all their files, keep a single
+        # (interned) copy of each
+        for i in itertools.compress(xrange(first, self.entries),
+                itertools.imap(operator.eq, self.orgPathIndex[first:],
+                               itertools.repeat(0xffffffff))):
+            name = self.name[i]
+            if name:
+                self.dirNames[i] = intern(name)
+
+        self.facesArray = _Children(empty, self.orgPathIndex)
 
 
     def indexOfFile(self, findMe):
@@ -168,16 +527,162 @@ class ThumbIndex(object):
 
         '''
 
-        self.findPath = os.path.dirname(findMe) + "/"
-        self.findName = os.path.basename(findMe)
+        if self.fileIndex is None:
+            self.buildFileIndex()
 
-        for i in range(self.entries):
-            if self.pathIndex[i] != 0xffffff:
-                if self.name[i] == self.findName:
-                    if self.name[self.pathIndex[i]] == self.findPath:
-                        return i
+        return self.fileIndex.get(
+            (os.path.dirname(findMe) + "/", os.path.basename(findMe)), -1)
 
-        return -1
+    def indexOfFiles(self, findUs):
+        '''
+
+        Find the indexes of all the image files in findUs.  Returns a list
+        in the same order, with -1 for each file that is not found.
+
+        '''
+
+        if self.fileIndex is None:
+            self.buildFileIndex()
+
+        get = self.fileIndex.get
+        return [get((os.path.dirname(findMe) + "/",
+                     os.path.basename(findMe)), -1) for findMe in findUs]
+
+    def buildFileIndex(self, first=0):
+        '''
+
+        Build the { (path, basename):index } dictionary used by
+        indexOfFile().  Directories and deleted entries are left out.  If
+        the same file appears more than once the first entry wins.
+
+        With first > 0 only the entries from 'first' on are added to the
+        existing dictionary.
+
+        '''
+
+        if first == 0:
+            self.fileIndex = {}
+
+        # one pass over the names and parents with the lookup of
+        # imagePath() done inline.  As in doEntries() the garbage collector
+        # is kept out of it.
+        add = self.fileIndex.setdefault
+        dirNames = self.dirNames
+        name = self.name
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            for i, baseName, parent in itertools.izip(
+                    itertools.count(first),
+                    itertools.islice(name, first, None),
+                    itertools.islice(self.pathIndex, first, None)):
+                if parent != 0xffffffff:
+                    path = dirNames.get(parent)
+                    if path is None:  # not a directory entry
+                        path = name[parent]
+                    add((path, baseName), i)
+        finally:
+            if gcEnabled:
+                gc.enable()
+
+    def buildDirIndex(self):
+        '''
+
+        Build the sorted list of directory names dirKeys[] (with their
+        entries in dirEntries[]) and the files of each directory (dirFiles)
+        used by entriesUnder(), locate() and glob().
+
+        '''
+
+        dirs = sorted((name, i) for i, name in self.dirNames.iteritems())
+        self.dirKeys = [name for name, i in dirs]
+        self.dirEntries = array.array('I', [i for name, i in dirs])
+        self.dirFiles = _Children(
+            itertools.compress(xrange(self.entries),
+                itertools.imap(operator.ne, self.pathIndex,
+                               itertools.repeat(0xffffffff))),
+            self.pathIndex)
+
+    def dirRange(self, prefix):
+        '''
+
+        Return the (start, stop) range of dirKeys[] of the directories
+        whose names start with prefix.
+
+        '''
+
+        if self.dirKeys is None:
+            self.buildDirIndex()
+
+        start = bisect.bisect_left(self.dirKeys, prefix)
+        stop = start
+        while stop < len(self.dirKeys) and \
+                self.dirKeys[stop].startswith(prefix):
+            stop += 1
+        return start, stop
+
+    def entriesUnder(self, prefix):
+        '''
+
+        Return an array('I') of the entries of all the files in the
+        directories whose names start with prefix, i.e. "/photos/2011/"
+        for everything in and below /photos/2011.  The prefix is matched
+        as a string, so "/photos/2011" also finds "/photos/2011-old/".
+
+        Files are grouped by directory, in directory name order.  The
+        directory index is built on the first query, after that the time
+        taken depends only on the size of the result.
+
+        '''
+
+        start, stop = self.dirRange(prefix)
+        found = array.array('I')
+        for n in xrange(start, stop):
+            found.extend(self.dirFiles.get(self.dirEntries[n], ()))
+        return found
+
+    def locate(self, pattern, start=""):
+        '''
+
+        Like pmpinfo.locate() but using the entries instead of the file
+        system: return a list of the entries of the files under the
+        directory start whose basename matches the glob pattern, in the
+        same order as entriesUnder().
+
+        '''
+
+        found = []
+        for i in self.entriesUnder(start):
+            if fnmatch.fnmatch(self.name[i], pattern):
+                found.append(i)
+        return found
+
+    def glob(self, pattern):
+        '''
+
+        Return a list of the entries of the files whose full path name
+        matches the glob pattern, i.e. "/photos/20??/*.JPG".  As with
+        fnmatch a '*' also matches the path separator.  Only the
+        directories starting with the directory part of pattern before the
+        first wildcard are looked at.  Files are grouped by directory, as in
+        entriesUnder().
+
+        '''
+
+        # directory names end in a separator, so leave out the part of the
+        # base name before the wildcard
+        literal = re.match('[^*?[]*', pattern).group()
+        literal = literal[:max(literal.rfind('/'), literal.rfind(os.sep)) + 1]
+        start, stop = self.dirRange(literal)
+        match = re.compile(fnmatch.translate(pattern)).match
+
+        found = []
+        for n in xrange(start, stop):
+            path = self.dirKeys[n]
+            for i in self.dirFiles.get(self.dirEntries[n], ()):
+                if match(path + self.name[i]):
+                    found.append(i)
+        return found
 
     def imagePath(self, what):
         '''
@@ -190,10 +695,13 @@ class ThumbIndex(object):
 
         '''
 
-        if self.pathIndex[what] == 0xffffffff:
+        path = self.pathIndex[what]
+        if path == 0xffffffff:
             return ""
-        else:
-            return self.name[self.pathIndex[what]]
+        try:
+            return self.dirNames[path]
+        except KeyError:  # not a directory entry
+            return self.name[path]
 
     def imageName(self, what):
         '''
@@ -214,24 +722,31 @@ class ThumbIndex(object):
         An exception will be thrown if you ask for an entry > number of entries
         in thumbindex.db (self.entries)
 
+        If the ThumbIndex was created with pathCache=n the n most recently
+        used full path names are kept and returned again.
+
         '''
 
-        return os.path.join(self.imagePath(what), self.imageName(what))
+        if self.fullNames is None:
+            return os.path.join(self.imagePath(what), self.imageName(what))
+
+        fullName = self.fullNames.get(what)
+        if fullName is None:
+            fullName = os.path.join(self.imagePath(what), self.imageName(what))
+            self.fullNames.put(what, fullName)
+        return fullName
 
 
 
     def getFaces(self, what):
         '''
-        Return a list of the faces in the image at index 'what'
+        Return the faces in the image at index 'what'
 
-        returns a list item or None
+        returns an array('I') of the face entries or None
 
         '''
 
-        if self.facesArray.has_key(what):
-            return self.facesArray[what]
-        else:
-            return None
+        return self.facesArray.get(what)
 
     def hasFaces(self, what):
         '''
@@ -239,19 +754,13 @@ class ThumbIndex(object):
 
         '''
 
-        if self.facesArray.has_key(what):
-            return True
-        else:
-            return False
+        return what in self.facesArray
 
 
     def dumpFaces(self, what):
         '''dump the faces array for image 'what' '''
 
-        if self.facesArray.has_key(what):
-            return self.facesArray[what]
-        else:
-            return None
+        return self.facesArray.get(what)
 
 
 
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+
+
+Time the expat contacts.xml reader of contacts.Contacts against the old
+xml.sax one (sax=True) on a synthetic contacts.xml file.
+
+Usage:
+
+    python tools/contactsbench.py [contacts [repeat]]
+
+The file has 'contacts' contacts (default 80000) and each reader is run
+'repeat' times (default 5), the best time is printed.
+
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from picasa3meta import contacts
+
+
+def makeContacts(contactsFile, count):
+    '''Write a contacts.xml file with 'count' contacts to contactsFile'''
+
+    rand = random.Random(5)
+    out = ['<?xml version="1.0" encoding="utf-8"?>', '<contacts>']
+    for n in xrange(count):
+        out.append(' <contact id="%016x" name="Person %d &amp; Co \xc3\xa9" '
+                   'display="P%d" modified_time="2011-12-12T15:09:12+01:00" '
+                   'local_contact="%d">' % (rand.getrandbits(64), n, n, n % 2))
+        out.append('  <subject user="u%d@example.com" sync_enabled="1"/>' % n)
+        out.append(' </contact>')
+    out.append('</contacts>')
+
+    outFile = open(contactsFile, "wb")
+    outFile.write('\n'.join(out) + '\n')
+    outFile.close()
+
+
+
+def best(function, repeat):
+    '''Return the best time of 'repeat' calls of function()'''
+
+    times = []
+    for n in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+
+if __name__ == '__main__':
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 80000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        contactsFile = os.path.join(tmpDir, "contacts.xml")
+        makeContacts(contactsFile, count)
+
+        if contacts.Contacts(contactsFile).handler.mapping != \
+                contacts.Contacts(contactsFile, sax=True).handler.mapping:
+            sys.exit("the readers found different contacts")
+
+        saxTime = best(lambda: contacts.Contacts(contactsFile, sax=True),
+                       repeat)
+        expatTime = best(lambda: contacts.Contacts(contactsFile), repeat)
+
+        print "%d contacts, best of %d" % (count, repeat)
+        print "    sax=True: %.3fs" % saxTime
+        print "    expat:    %.3fs (%.1fx)" % (expatTime, saxTime / expatTime)
+    finally:
+        shutil.rmtree(tmpDir)
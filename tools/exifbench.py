@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+
+
+Time exiv2meta.EXIV2Meta() reading whole files against fast=True, which
+only reads the JPEG headers.  Needs pyexiv2.
+
+Usage:
+
+    python tools/exifbench.py [images [megabytes [repeat]]]
+
+Writes 'images' (default 50) synthetic JPEG files of 'megabytes' (default
+6) each, with Exif, XMP and IPTC segments, and reads their metadata both
+ways 'repeat' times (default 3).  For each way the best images/s and the
+MB read per image are printed.  The MB read are the bytes this process
+read (rchar in /proc/self/io, which leaves out files pyexiv2 memory
+maps), or the file/header sizes where there is no /proc.  The files are
+read from the page cache, on a network share the difference is larger.
+
+'''
+
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from picasa3meta import exiv2meta
+
+
+def _segment(marker, data):
+    '''Return a JPEG segment: ff <marker> <length> data'''
+
+    return struct.pack('>BBH', 0xff, marker, len(data) + 2) + data
+
+
+
+def _exif(comment):
+    '''Return an APP1 Exif segment with a few tags and a long UserComment'''
+
+    def ifd(entries, start, extra):
+        # entries: [ (tag, type, count, value or data), ... ] of one IFD
+        # starting at 'start', values that do not fit in 4 bytes are put
+        # after it in extra
+        out = struct.pack('<H', len(entries))
+        offset = start + 2 + 12 * len(entries) + 4
+        for tag, kind, count, value in entries:
+            if isinstance(value, str) and len(value) > 4:
+                out += struct.pack('<HHII', tag, kind, count,
+                                   offset + len(extra[0]))
+                extra[0] += value
+            elif isinstance(value, str):
+                out += struct.pack('<HHI', tag, kind, count) + \
+                    value.ljust(4, '\x00')
+            else:
+                out += struct.pack('<HHII', tag, kind, count, value)
+        return out + struct.pack('<I', 0)
+
+    make = 'picasa3meta\x00'
+    model = 'exifbench\x00'
+    date = '2011:09:01 12:00:00\x00'
+    comment = 'ASCII\x00\x00\x00' + comment
+
+    extra0 = [""]
+    ifd0Size = 2 + 12 * 3 + 4
+    exifStart = 8 + ifd0Size + len(make) + len(model)
+    ifd0 = ifd([(0x010f, 2, len(make), make),
+                (0x0110, 2, len(model), model),
+                (0x8769, 4, 1, exifStart)], 8, extra0)
+    extra1 = [""]
+    exifIfd = ifd([(0x9003, 2, len(date), date),
+                   (0x9286, 7, len(comment), comment)], exifStart, extra1)
+
+    tiff = 'II*\x00' + struct.pack('<I', 8) + ifd0 + extra0[0] + exifIfd + \
+        extra1[0]
+    return _segment(0xe1, 'Exif\x00\x00' + tiff)
+
+
+
+def _xmp(title, padding):
+    '''Return an APP1 XMP segment with a dc:title'''
+
+    packet = ('<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+              '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+              '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+              '<rdf:Description rdf:about="" '
+              'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+              '<dc:title><rdf:Alt><rdf:li xml:lang="x-default">%s</rdf:li>'
+              '</rdf:Alt></dc:title></rdf:Description></rdf:RDF>'
+              '</x:xmpmeta>%s<?xpacket end="w"?>' % (title, ' ' * padding))
+    return _segment(0xe1, 'http://ns.adobe.com/xap/1.0/\x00' + packet)
+
+
+
+def _iptc(caption):
+    '''Return an APP13 segment with an IPTC caption'''
+
+    iim = struct.pack('>BBBH', 0x1c, 2, 0, 2) + '\x00\x04' + \
+        struct.pack('>BBBH', 0x1c, 2, 120, len(caption)) + caption
+    if len(iim) % 2:
+        iim += '\x00'
+    resource = '8BIM' + struct.pack('>H', 0x0404) + '\x00\x00' + \
+        struct.pack('>I', len(iim)) + iim
+    return _segment(0xed, 'Photoshop 3.0\x00' + resource)
+
+
+
+def makeJpeg(fileName, size, n):
+    '''
+
+    Write a JPEG file of about 'size' bytes:  30KB of Exif, 8KB of XMP and
+    2KB of IPTC followed by random bytes for the image data.
+
+    '''
+
+    rand = random.Random(n)
+    header = '\xff\xd8' + \
+        _exif('comment %d ' % n + 'x' * 30000) + \
+        _xmp('image %d' % n, 8000) + \
+        _iptc('caption %d ' % n + 'y' * 2000) + \
+        _segment(0xda, '\x01\x01\x00\x00\x3f\x00')
+
+    outFile = open(fileName, "wb")
+    outFile.write(header)
+    left = size - len(header) - 2
+    while left > 0:
+        chunk = min(left, 1 << 20)
+        outFile.write(''.join(chr(rand.randint(0, 0xfe))
+                              for i in xrange(256)) * (chunk // 256))
+        outFile.write('\x00' * (chunk % 256))
+        left -= chunk
+    outFile.write('\xff\xd9')
+    outFile.close()
+
+
+
+def bytesRead():
+    '''Return the number of bytes this process has read, or None'''
+
+    try:
+        for line in open('/proc/self/io'):
+            if line.startswith('rchar:'):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+
+def run(images, fast, repeat):
+    '''
+
+    Read the metadata of all images 'repeat' times.  Returns the best
+    time, the bytes read per image and the results of the last pass.
+
+    '''
+
+    best = None
+    for n in range(repeat):
+        before = bytesRead()
+        start = time.time()
+        results = [exiv2meta.EXIV2Meta(img, fast=fast) for img in images]
+        elapsed = time.time() - start
+        after = bytesRead()
+        if best is None or elapsed < best:
+            best = elapsed
+
+    if before is not None and after is not None:
+        perImage = float(after - before) / len(images)
+    elif fast:
+        perImage = float(sum(len(exiv2meta.jpegHeader(img) or "")
+                             for img in images)) / len(images)
+    else:
+        perImage = float(sum(os.path.getsize(img)
+                             for img in images)) / len(images)
+
+    return best, perImage, results
+
+
+
+if __name__ == '__main__':
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    size = float(sys.argv[2]) if len(sys.argv) > 2 else 6
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        images = []
+        for n in range(count):
+            images.append(os.path.join(tmpDir, "%04d.jpg" % n))
+            makeJpeg(images[-1], int(size * 1e6), n)
+
+        full = run(images, False, repeat)
+        fast = run(images, True, repeat)
+
+        if full[2] != fast[2]:
+            sys.exit("the full and the fast read found different metadata")
+        if [meta for meta in full[2] if meta and meta[0][0] == 'error']:
+            sys.exit("pyexiv2 could not read the test images")
+
+        print "%d images of %.1f MB, best of %d" % (count, size, repeat)
+        for name, (best, perImage, results) in (("full read:", full),
+                                                ("fast=True:", fast)):
+            print "    %-11s %8.3f MB/image %8.0f images/s" % (
+                name, perImage / 1e6, count / best)
+    finally:
+        shutil.rmtree(tmpDir)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+'''
+This file is part of picasa3meta.
+
+picasa3meta is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+picasa3meta is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with picasa3meta.  If not, see <http://www.gnu.org/licenses/>.
+
+Copyright 2012 Wayne Vosberg <wayne.vosberg@mindtunnel.com>
+
+
+Time the .picasa.ini parser of iniinfo.IniInfo against the old regex
+based one on a synthetic .picasa.ini file.
+
+Usage:
+
+    python tools/inibench.py [lines [repeat]]
+
+The file has about 'lines' lines (default 50000) and each parser is run
+'repeat' times (default 5), the best time is printed.
+
+'''
+
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from picasa3meta import iniinfo
+
+
+class _Contacts(object):
+    '''Just enough of a contacts.Contacts for the faces entries'''
+
+    def getContact(self, contactId):
+        return {'e1363a4accda66d5': 'Contact1 Name'}.get(contactId,
+                                                          'unknown')
+
+
+
+def makeIni(iniFile, lines):
+    '''Write a .picasa.ini file of about 'lines' lines to iniFile'''
+
+    rand = random.Random(5)
+    out = ['[Picasa]', 'name=bench', 'date=40788.407998']
+    i = 0
+    while len(out) < lines:
+        out.append('[IMG_%05d.JPG]' % i)
+        out.append('backuphash=%d' % rand.randint(0, 99999))
+        if i % 3 == 0:
+            out.append('caption=a caption with = and more %d' % i)
+        if i % 4 == 0:
+            out.append('faces=rect64(3f845bcb59418507),e1363a4accda66d5;'
+                       'rect64(%x),d80c848976f5bab6' % rand.getrandbits(64))
+        if i % 5 == 0:
+            out.append('crop=rect64(%x)' % rand.getrandbits(60))
+        if i % 7 == 0:
+            out.append('star=yes')
+        i += 1
+
+    outFile = open(iniFile, "wb")
+    outFile.write('\r\n'.join(out) + '\r\n')
+    outFile.close()
+
+
+
+def oldParse(iniFile, contacts=None):
+    '''
+
+    The parser IniInfo used before it kept (key, value) pairs:  a regex
+    search for the '[image]' lines and one for each crop.  Returns
+    (names, contents) the way it built them.
+
+    '''
+
+    names = []
+    contents = {}
+
+    inIni = open(iniFile, "r")
+    i = 0
+
+    for line in inIni:
+        line = line.rstrip('\n\r')
+        try:
+            m = re.search('(?<=\[)[^\]]+', line)
+            image = m.group(0)
+
+            names.append(image)
+            contents[names[i]] = []
+            i += 1
+
+        except:
+            if len(names) == 0:
+                raise iniinfo.IniStructError(
+                    "unexpected lines in %s before a file designator"\
+                    % iniFile)
+            else:
+                contents[names[i - 1]].append(line.replace('=', ':', 1))
+                (key, sep, val) = line.partition('=')
+                if key == "faces" and contacts != None:
+                    sfaces = "sfaces:"
+                    for people in val.split(';'):
+                        if sfaces != "sfaces:":
+                            sfaces += ","
+                        person = people.split(',')
+                        sfaces += '"' + contacts.getContact(person[1]) + '"'
+                    contents[names[i - 1]].append(sfaces)
+                elif key == "crop":
+                    m1 = re.search('(?<=rect64\()[^\)]+', val)
+                    crop64 = long(m1.group(0), 16)
+                    mx = float(int(0xffff))
+                    x1 = float((crop64 & 0xffff000000000000) >> 48) / mx
+                    y1 = float((crop64 & 0x0000ffff00000000) >> 32) / mx
+                    x2 = float((crop64 & 0x00000000ffff0000) >> 16) / mx
+                    y2 = float(crop64 & 0x000000000000ffff) / mx
+                    contents[names[i - 1]].append(
+                        "cropxy:%f,%f,%f,%f" % (x1, y1, x2, y2))
+    inIni.close()
+
+    return names, contents
+
+
+
+def best(function, repeat):
+    '''Return the best time of 'repeat' calls of function()'''
+
+    times = []
+    for n in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+
+if __name__ == '__main__':
+
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        iniFile = os.path.join(tmpDir, ".picasa.ini")
+        makeIni(iniFile, lines)
+        contacts = _Contacts()
+
+        old = oldParse(iniFile, contacts)
+        new = iniinfo.IniInfo(iniFile, contacts)
+        if old[0] != new.names:
+            sys.exit("the parsers found different images")
+
+        oldTime = best(lambda: oldParse(iniFile, contacts), repeat)
+        newTime = best(lambda: iniinfo.IniInfo(iniFile, contacts), repeat)
+
+        print "%d lines, %d images, best of %d" % (lines, len(new.names),
+                                                   repeat)
+        print "    old parser: %.3fs" % oldTime
+        print "    IniInfo:    %.3fs (%.1fx)" % (newTime, oldTime / newTime)
+    finally:
+        shutil.rmtree(tmpDir)